@@ -1,18 +1,33 @@
+import time
+
+STARTED_AT = time.perf_counter()
+
+import argparse
+import importlib
+import os
+import queue
+import sys
+import threading
 import tkinter as tk
 from tkinter import filedialog, messagebox, ttk
-import pandas as pd
-import matplotlib.pyplot as plt
-from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
-import numpy as np
 from tkinter import font as tkfont
-import openpyxl
-from openpyxl.styles import Font, Alignment, Border, Side
-from openpyxl.chart import PieChart, Reference
-from openpyxl.chart.label import DataLabelList
-import os
+from promo_catalog import DEFAULT_PROMOS, PROMO_NAMES
+from promo_profile import NO_PROFILE, RunProfile
+
+# pandas, numpy, matplotlib, openpyxl and pyarrow are imported lazily (see warm_up) so the
+# promo selection appears before they finish loading
+
+POLL_INTERVAL_MS = 100  # How often the UI drains the worker's progress queue
+READ_SHARE = 0.8  # Share of the progress bar given to parsing the export
+STARTUP_BUDGET_S = 1.0  # Seconds from launch until the window is drawn; checked by --startup-check
+PREVIEW_FIRST_ROWS = 10_000  # Rows parsed before the first preview; it is redone each time they double
+PREVIEW_MIN_ROWS = 200_000  # Exports loaded from the cache get a preview only from this size up
+
+HEAVY_MODULES = ["promo_engine", "promo_cache", "promo_export", "promo_store", "matplotlib.figure",
+                 "matplotlib.backends.backend_tkagg"]
 
 class PromoAnalysisTool:
-    def __init__(self, master):
+    def __init__(self, master, profile_dir=None, cprofile=False, profile_memory=True):
         self.master = master
         self.master.title("M.J. BALE Promo Analysis Tool")
         self.master.geometry("1000x1100")
@@ -39,31 +54,31 @@ class PromoAnalysisTool:
         # Increase tab font size
         self.style.configure("TNotebook.Tab", font=('Helvetica', 14, 'bold'))
 
-        self.promo_functions = {
-            "$399 & $599 Suits": self.analyze_sublime_suits,
-            "25% Off Chinos": self.analyze_chino_25_percent_off,
-            "25% Off Coats/Outerwear": self.analyze_25_percent_off_coats,
-            "25% Off Selected Styles": self.analyze_25_percent_off,
-            "25% Off Tailoring": self.analyze_25_percent_off_winter_tailoring,
-            "40% Off Tailoring": self.analyze_40_percent_off_tailoring,
-            "50% Off 50 Styles": self.analyze_50_50,
-            "Casual Bottom Multibuy": self.analyze_casual_bottom_multibuy,
-            "Chino Multibuy": self.analyze_chino_multibuy,
-            "FP Purchase": self.analyze_fp_purchase,
-            "Gift Card": self.analyze_gift_card,
-            "Knits Offer": self.analyze_25_percent_off_knits,
-            "Linen Shirts Multibuy": self.analyze_linen_shirts_multibuy,
-            "MD Purchase": self.analyze_md_purchase,
-            "Polo Multibuy": self.analyze_polo_multibuy,
-            "Promo Code": self.analyze_promo_code,
-            "Shirts Multibuy": self.analyze_shirts_multibuy,
-            "Suit Multibuy": self.analyze_suit_multibuy,
-            "TAF25": self.analyze_taf25,
-            "Tee Multibuy": self.analyze_tee_multibuy
-        }
+        self.promo_names = PROMO_NAMES
+        self.export_cache = None
+        self.result_store = None
+        self.worker = None
+        self.df = None
+        self.cube = None  # aggregate cube the chart, summary and pivot sheet are served from
+        self.drill_slice = None  # chart slice currently split by tier, if any
+        self.preview = None  # sampled share estimates while the chart shows a preview, else None
+        self.preview_note = ""
+        self.fig = None
+
+        # With a profile_dir, each run's per-stage report is written there (see promo_profile)
+        self.profile_dir = profile_dir
+        self.cprofile = cprofile
+        self.profile_memory = profile_memory
+        self.profile = NO_PROFILE
 
         self.create_widgets()
 
+        # Start loading the analysis libraries once the window is up
+        self.master.after_idle(self.start_warm_up)
+
+    def start_warm_up(self):
+        threading.Thread(target=warm_up, daemon=True).start()
+
     def create_widgets(self):
         # Create a notebook (tabbed interface)
         self.notebook = ttk.Notebook(self.master)
@@ -94,11 +109,9 @@ class PromoAnalysisTool:
         ttk.Label(frame, text="Select Active Promotions:", font=("Helvetica", 18, "bold")).grid(column=0, row=0, sticky=tk.W, pady=(0, 20))
 
         self.promo_vars = {}
-        default_checked = ["Chino Multibuy", "FP Purchase", "Gift Card", "Linen Shirts Multibuy",
-                           "MD Purchase", "Polo Multibuy", "Promo Code", "Shirts Multibuy",
-                           "Suit Multibuy", "Tee Multibuy"]
+        default_checked = DEFAULT_PROMOS
 
-        for i, promo in enumerate(sorted(self.promo_functions.keys())):  # Sort promos alphabetically
+        for i, promo in enumerate(self.promo_names):  # Sorted alphabetically
             var = tk.BooleanVar(value=promo in default_checked)
             cb = ttk.Checkbutton(frame, text=promo, variable=var, style="Toggle.TCheckbutton")
             cb.grid(column=i % 3, row=i // 3 + 1, sticky=tk.W, padx=(0, 20), pady=(0, 10))
@@ -109,11 +122,11 @@ class PromoAnalysisTool:
         frame.grid(row=0, column=0, sticky=(tk.W, tk.E, tk.N, tk.S))
 
         # Create a modern-looking upload button
-        upload_button = tk.Button(frame, text="Upload Excel File", command=self.analyze_file,
-                                  font=('Helvetica', 14), bg="#4CAF50", fg="white",
-                                  activebackground="#45a049", activeforeground="white",
-                                  relief=tk.FLAT, padx=20, pady=10)
-        upload_button.grid(column=0, row=0, pady=20)
+        self.upload_button = tk.Button(frame, text="Upload Excel File", command=self.analyze_file,
+                                       font=('Helvetica', 14), bg="#4CAF50", fg="white",
+                                       activebackground="#45a049", activeforeground="white",
+                                       relief=tk.FLAT, padx=20, pady=10)
+        self.upload_button.grid(column=0, row=0, pady=20)
 
         self.file_label = ttk.Label(frame, text="No file selected", style="TLabel")
         self.file_label.grid(column=0, row=1, pady=10)
@@ -121,6 +134,27 @@ class PromoAnalysisTool:
         self.progress = ttk.Progressbar(frame, orient=tk.HORIZONTAL, length=400, mode='determinate', style="TProgressbar")
         self.progress.grid(column=0, row=2, pady=20)
 
+        self.status_label = ttk.Label(frame, text="", style="TLabel")
+        self.status_label.grid(column=0, row=3, pady=10)
+
+        self.cancel_button = tk.Button(frame, text="Cancel", command=self.cancel_analysis,
+                                       font=('Helvetica', 14), bg="#f44336", fg="white",
+                                       activebackground="#da190b", activeforeground="white",
+                                       relief=tk.FLAT, padx=20, pady=10, state=tk.DISABLED)
+        self.cancel_button.grid(column=0, row=4, pady=10)
+
+        # Reuse stored results for orders seen unchanged in earlier runs (see promo_store)
+        self.incremental_var = tk.BooleanVar(value=False)
+        incremental = ttk.Checkbutton(frame, text="Only classify new or changed orders",
+                                      variable=self.incremental_var, style="TCheckbutton")
+        incremental.grid(column=0, row=5, pady=10)
+
+        # Chart a sampled estimate while the exact analysis runs (see promo_engine.preview_analysis)
+        self.preview_var = tk.BooleanVar(value=True)
+        preview = ttk.Checkbutton(frame, text="Preview a sample while the full analysis runs",
+                                  variable=self.preview_var, style="TCheckbutton")
+        preview.grid(column=0, row=6, pady=10)
+
         # Configure progress bar style
         self.style.configure("TProgressbar", thickness=25, troughcolor='#f0f0f0',
                              background='#4CAF50', bordercolor='#f0f0f0')
@@ -140,9 +174,8 @@ class PromoAnalysisTool:
         scrollbar.grid(column=1, row=0, sticky='ns')
         self.result_text.configure(yscrollcommand=scrollbar.set)
 
-        self.fig, self.ax = plt.subplots(figsize=(8, 6), dpi=100)
-        self.canvas = FigureCanvasTkAgg(self.fig, master=frame)
-        self.canvas.get_tk_widget().grid(column=0, row=1, pady=20, columnspan=2)
+        # The chart canvas is built on first use, see ensure_chart
+        self.results_frame = frame
 
         # Create a modern-looking save button
         self.save_button = tk.Button(frame, text="Save Results", command=self.save_results,
@@ -156,60 +189,202 @@ class PromoAnalysisTool:
         frame.rowconfigure(1, weight=1)
 
     def analyze_file(self):
+        if self.worker is not None:
+            return
+
         file_path = filedialog.askopenfilename(filetypes=[("Excel files", "*.xlsx")])
         if not file_path:
             return
 
         self.file_label.config(text=f"Selected file: {file_path}")
 
-        df = pd.read_excel(file_path)
-
-        # Add new columns
-        df.insert(0, "Promo Type", "")
-        df.insert(1, "Tier Group", "")
-
-        # Update progress bar
-        total_steps = len(self.promo_vars) + 4  # +4 for additional steps
-        step = 0
-
-        # Apply selected promo analyses
-        for promo, var in self.promo_vars.items():
-            if var.get():
-                df = self.promo_functions[promo](df)
-                step += 1
-                self.progress['value'] = (step / total_steps) * 100
-                self.master.update_idletasks()
-
-        # Additional analyses
-        df = self.drop_shipping_lines(df)
-        step += 1
-        self.progress['value'] = (step / total_steps) * 100
-        self.master.update_idletasks()
-
-        df = self.analyze_fp_purchase(df)
-        step += 1
-        self.progress['value'] = (step / total_steps) * 100
-        self.master.update_idletasks()
-
-        df = self.drop_discount_lines(df)
-        step += 1
-        self.progress['value'] = (step / total_steps) * 100
-        self.master.update_idletasks()
-
-        df['Tier Group'] = df['Customer: Tags'].apply(lambda tags: self.get_tier_group(tags))
-        step += 1
-        self.progress['value'] = 100  # Ensure progress bar reaches 100%
-        self.master.update_idletasks()
+        # Snapshot the selection now; the toggles stay live for setting up the next run
+        promos = [promo for promo, var in self.promo_vars.items() if var.get()]
+
+        # A preview or drill-down left over from an earlier (possibly cancelled) run doesn't apply
+        self.preview = None
+        self.drill_slice = None
+
+        self.cancel_event = threading.Event()
+        self.start_worker(self.run_worker, "Reading file...",
+                          file_path, promos, self.incremental_var.get(), self.preview_var.get(), self.cancel_event)
+        self.cancel_button.config(state=tk.NORMAL)
+
+    def start_worker(self, target, status, *args):
+        # Run target(*args, messages) on a worker thread; poll_worker relays what it posts
+        self.worker_queue = queue.Queue()
+        self.started_at = time.monotonic()
+        self.progress['value'] = 0
+        self.status_label.config(text=status)
+        self.upload_button.config(state=tk.DISABLED)
+
+        self.worker = threading.Thread(target=target, args=args + (self.worker_queue,), daemon=True)
+        self.worker.start()
+        self.master.after(POLL_INTERVAL_MS, self.poll_worker)
+
+    def run_worker(self, file_path, promos, incremental, preview, cancel, messages):
+        # Runs on the worker thread: never touch Tk widgets here, only post to `messages`
+        import promo_engine
+        from promo_cache import ExportCache
+
+        if self.export_cache is None:
+            self.export_cache = ExportCache()
+        if incremental and self.result_store is None:
+            from promo_store import ResultStore
+
+            self.result_store = ResultStore()
+
+        def on_rows(rows_read, total_rows):
+            if total_rows:
+                messages.put(("progress", READ_SHARE * min(rows_read / total_rows, 1),
+                              f"Parsed {rows_read:,} of {total_rows:,} rows"))
+            else:
+                messages.put(("progress", 0, f"Parsed {rows_read:,} rows"))
+
+        def on_step(step, total_steps):
+            messages.put(("progress", READ_SHARE + (1 - READ_SHARE) * step / total_steps,
+                          f"Applied {step} of {total_steps} analysis steps"))
+
+        next_preview = PREVIEW_FIRST_ROWS
+
+        def post_preview(df, partial=False, total_rows=None):
+            cube, estimates, orders = promo_engine.preview_analysis(df, promos, partial, total_rows)
+            if not partial:
+                note = f"Estimated from a sample of {orders:,} orders"
+            elif total_rows:
+                note = f"Estimated from {orders:,} orders in the first {len(df):,} of {total_rows:,} lines"
+            else:
+                note = f"Estimated from {orders:,} orders in the first {len(df):,} lines, totals so far"
+            messages.put(("preview", cube, estimates, note))
+
+        def on_chunks(chunks, total_rows):
+            # While an uncached export parses, preview the orders read so far
+            nonlocal next_preview
+            rows_read = sum(len(chunk) for chunk in chunks)
+            if rows_read >= next_preview and (not total_rows or rows_read < total_rows):
+                post_preview(promo_engine.concat_chunks(chunks), True, total_rows)
+                next_preview = 2 * rows_read
+
+        profile = NO_PROFILE
+        if self.profile_dir:
+            profile = RunProfile(label=file_path, track_memory=self.profile_memory, cprofile=self.cprofile)
+        try:
+            with profile:
+                with profile.stage("read") as stage:
+                    df = promo_engine.load_cached(
+                        self.export_cache, file_path, lambda path: promo_engine.read_export_streamed(
+                            path, on_rows, cancel, partial=on_chunks if preview else None))
+                    stage['rows_out'] = len(df)
+                messages.put(("progress", READ_SHARE, f"Loaded {len(df):,} rows"))
+                if preview and next_preview == PREVIEW_FIRST_ROWS and len(df) >= PREVIEW_MIN_ROWS:
+                    # Nothing previewed while reading (a cache hit): preview the whole export once
+                    post_preview(df)
+                analyze = self.result_store.analyze if incremental else promo_engine.run_analysis
+                df = analyze(df, promos, progress=on_step, cancel=cancel, profile=profile)
+                with profile.stage("aggregate cube", rows_in=len(df)) as stage:
+                    cube = promo_engine.build_cube(df)
+                    stage['rows_out'] = len(cube)
+        except promo_engine.AnalysisCancelled:
+            messages.put(("cancelled",))
+        except Exception as e:
+            messages.put(("error", str(e)))
+        else:
+            summary = ""
+            if incremental:
+                summary = (f" ({self.result_store.orders_classified:,} of {self.result_store.orders_seen:,} "
+                           f"orders new or changed)")
+            messages.put(("done", df, profile, summary, cube))
+
+    def poll_worker(self):
+        finished = False
+        try:
+            while True:
+                message = self.worker_queue.get_nowait()
+                if message[0] == "preview":
+                    self.show_preview(message)
+                    continue
+                if message[0] != "progress":
+                    finished = True
+                    self.finish_worker(message)
+                    return
+                _, fraction, text = message
+                self.progress['value'] = fraction * 100
+                self.status_label.config(text=text + self.format_eta(fraction))
+        except queue.Empty:
+            pass
+        finally:
+            # Keep polling even if drawing a preview failed, or the worker's result is never read
+            if not finished:
+                self.master.after(POLL_INTERVAL_MS, self.poll_worker)
+
+    def format_eta(self, fraction):
+        if fraction < 0.02:
+            return ""
+        elapsed = time.monotonic() - self.started_at
+        remaining = int(elapsed * (1 - fraction) / fraction)
+        return f" - about {remaining // 60}:{remaining % 60:02d} left"
+
+    def cancel_analysis(self):
+        if self.worker is not None:
+            self.cancel_event.set()
+            self.status_label.config(text="Cancelling...")
+            self.cancel_button.config(state=tk.DISABLED)
+
+    def show_preview(self, message):
+        # A sampled estimate while the exact analysis keeps running; finish_worker replaces it
+        first = self.preview is None
+        _, self.cube, self.preview, note = message
+        self.preview_note = note + "; the exact analysis is still running."
+        if first:
+            self.drill_slice = None
+        self.create_pivot_chart()
+        if first:
+            self.notebook.select(self.results_tab)
+
+    def finish_worker(self, message):
+        self.worker = None
+        self.upload_button.config(state=tk.NORMAL)
+        self.cancel_button.config(state=tk.DISABLED)
+
+        if message[0] == "saved":
+            self.progress['value'] = 100
+            self.status_label.config(text=f"Saved {message[1]} in {time.monotonic() - self.started_at:.1f}s")
+            self.save_profile()
+            messagebox.showinfo("Success", f"Excel file saved to: {message[1]}")
+            return
+        if message[0] == "save failed":
+            self.progress['value'] = 0
+            self.status_label.config(text="Saving failed")
+            messagebox.showerror("Save Error", message[1])
+            return
 
-        # Fill in blank 'Line: Product Type' based on 'Line: Title'
-        df.loc[(df['Line: Product Type'].isna()) & (df['Line: Title'].str.contains('Trouser', case=False, na=False)), 'Line: Product Type'] = 'Trousers'
-        df.loc[(df['Line: Product Type'].isna()) & (df['Line: Title'].str.contains('Waistcoat', case=False, na=False)), 'Line: Product Type'] = 'Waistcoat'
+        if message[0] in ("cancelled", "error") and self.preview is not None:
+            # Keep the preview on screen, no longer promising an exact result
+            self.preview_note = self.preview_note.replace("the exact analysis is still running",
+                                                          "the exact analysis did not finish")
+            self.create_pivot_chart()
+        if message[0] == "cancelled":
+            self.progress['value'] = 0
+            self.status_label.config(text="Analysis cancelled")
+            return
+        if message[0] == "error":
+            self.progress['value'] = 0
+            self.status_label.config(text="Analysis failed")
+            messagebox.showerror("Analysis Error", message[1])
+            return
 
-        self.df = df  # Store the DataFrame for later use
+        self.df = message[1]  # Store the DataFrame for later use
+        self.profile = message[2]
+        self.cube = message[4]
+        self.preview = None
+        self.drill_slice = None
+        self.save_profile()
+        self.progress['value'] = 100  # Ensure progress bar reaches 100%
+        self.status_label.config(text=f"Analysed {len(self.df):,} lines in {time.monotonic() - self.started_at:.1f}s"
+                                      + message[3])
 
         messagebox.showinfo("Analysis Result", "Analysis completed successfully!")
 
-        self.second_check()
         self.create_pivot_chart()
         self.notebook.select(self.results_tab)  # Switch to results tab
 
@@ -217,276 +392,165 @@ class PromoAnalysisTool:
         if messagebox.askyesno("Save Excel File", "Do you want to save the analysed data as an Excel file?"):
             self.save_excel_file()
 
-    def second_check(self):
-        df = self.df
-
-        # Define the suit multibuy prices
-        suit_multibuy_prices = [175, 200, 275, 350, 400, 425, 575, 700]
-
-        # Apply Suit Multibuy tag
-        mask = (df['Line: Title'].str.contains('Jacket|Trouser', case=False, na=False)) & \
-               (df['Line: Total'].isin(suit_multibuy_prices))
-        df.loc[mask, 'Promo Type'] = 'Suit Multibuy'
-
-        self.df = df
-
-    def save_excel_file(self):
-        file_path = filedialog.asksaveasfilename(defaultextension=".xlsx", filetypes=[("Excel files", "*.xlsx")])
-        if file_path:
-            with pd.ExcelWriter(file_path, engine='openpyxl') as writer:
-                self.df.to_excel(writer, sheet_name='Sheet1', index=False)
-
-                # Create pivot table
-                pivot_table = pd.pivot_table(self.df, values=['Line: Quantity', 'Line: Total'],
-                                             index=['Promo Type'], aggfunc='sum')
-                pivot_table = pivot_table.sort_values('Line: Total', ascending=False)
-                pivot_table = pivot_table[pivot_table.index != '']  # Remove blank rows
-
-                # Reorder columns
-                pivot_table = pivot_table[['Line: Total', 'Line: Quantity']]
-
-                # Add total row
-                total_row = pd.DataFrame({
-                    'Line: Total': pivot_table['Line: Total'].sum(),
-                    'Line: Quantity': pivot_table['Line: Quantity'].sum()
-                }, index=['Total'])
-                pivot_table = pd.concat([pivot_table, total_row])
-
-                pivot_table.to_excel(writer, sheet_name='Promo Analysis', startrow=0, startcol=0)
-
-                workbook = writer.book
-                worksheet = workbook['Promo Analysis']
-
-                # Formatting
-                for col in ['A', 'B', 'C']:
-                    worksheet.column_dimensions[col].width = 20
-
-                for row in worksheet['A1:C1']:
-                    for cell in row:
-                        cell.font = Font(bold=True)
-
-                # Rename columns
-                worksheet['A1'] = 'Promo Type'
-                worksheet['B1'] = 'Sales $'
-                worksheet['C1'] = 'Quantity'
-
-                # Format Sales $ as currency
-                for cell in worksheet['B']:
-                    cell.number_format = '$#,##0'
-
-                # Create a more visually appealing and modern pie chart
-                labels = pivot_table.index.to_numpy()[:-1]  # Exclude 'Total' from labels
-                data = pivot_table['Line: Total'].to_numpy()[:-1]  # Exclude 'Total' from data
-
-                fig, ax = plt.subplots(figsize=(8, 6))  # Adjust figure size if needed
-                ax.pie(data, labels=labels, autopct='%1.0f%%', pctdistance=0.85)
-                ax.set_title("Promo Analysis by Sales $")
-
-                # Customize the chart appearance
-                ax.legend(bbox_to_anchor=(1.05, 1), loc='upper left')  # Move legend outside the chart
-                ax.axis('equal')
-
-                # Save the chart as an image within the workbook
-                chart_path = os.path.join(os.path.dirname(file_path), "chart.png")  # save chart in the same directory as the Excel file
-                plt.savefig(chart_path, bbox_inches='tight')
-
-                img = openpyxl.drawing.image.Image(chart_path)
-                worksheet.add_image(img, 'E2')
+    def save_excel_file(self, file_path=None):
+        if self.worker is not None:
+            messagebox.showinfo("Busy", "Wait for the current run to finish before saving.")
+            return
+        file_path = file_path or filedialog.asksaveasfilename(defaultextension=".xlsx",
+                                                              filetypes=[("Excel files", "*.xlsx")])
+        if not file_path:
+            return
+        from promo_export import EXCEL_MAX_ROWS, OVERFLOW_ERROR, OVERFLOW_SKIP, OVERFLOW_SPLIT
+
+        overflow = OVERFLOW_ERROR
+        if len(self.df) > EXCEL_MAX_ROWS - 1:
+            split = messagebox.askyesnocancel(
+                "Too Many Lines",
+                f"{len(self.df):,} lines don't fit on one Excel sheet (at most {EXCEL_MAX_ROWS - 1:,}).\n\n"
+                "Yes: continue the raw data on further sheets\n"
+                "No: save the pivot sheet only\n"
+                "Cancel: don't save")
+            if split is None:
+                return
+            overflow = OVERFLOW_SPLIT if split else OVERFLOW_SKIP
+        self.start_worker(self.run_save, "Saving workbook...", file_path, overflow)
+
+    def run_save(self, file_path, overflow, messages):
+        # Runs on the worker thread, like run_worker
+        from promo_export import save_workbook
+
+        def on_rows(rows_written, total_rows):
+            messages.put(("progress", rows_written / total_rows, f"Wrote {rows_written:,} of {total_rows:,} lines"))
+
+        try:
+            with self.profile:
+                save_workbook(self.df, file_path, overflow, profile=self.profile, cube=self.cube, progress=on_rows)
+        except Exception as e:
+            messages.put(("save failed", str(e)))
+        else:
+            messages.put(("saved", file_path))
 
-                messagebox.showinfo("Success", f"Excel file saved to: {file_path}")
+    def save_profile(self):
+        if self.profile is not NO_PROFILE:
+            stem = os.path.splitext(os.path.basename(self.profile.label))[0]
+            self.profile.save(self.profile_dir, stem)
 
     def save_results(self):
+        if self.preview is not None:
+            messagebox.showinfo("Preview", "The chart is a sampled preview; results can be saved once "
+                                           "the full analysis has finished.")
+            return
+
         # Save the Excel file
         excel_path = filedialog.asksaveasfilename(defaultextension=".xlsx", filetypes=[("Excel files", "*.xlsx")])
         if excel_path:
-            self.save_excel_file()
+            self.save_excel_file(excel_path)
 
         # Save the chart as an image
+        if self.fig is None:
+            return  # nothing has been charted yet
         chart_path = filedialog.asksaveasfilename(defaultextension=".png", filetypes=[("PNG files", "*.png")])
         if chart_path:
             self.fig.savefig(chart_path)
             messagebox.showinfo("Success", f"Chart saved to: {chart_path}")
 
+    def ensure_chart(self):
+        if self.fig is not None:
+            return
+        from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg
+        from matplotlib.figure import Figure
+
+        self.fig = Figure(figsize=(8, 6), dpi=100)
+        self.ax = self.fig.subplots()
+        self.canvas = FigureCanvasTkAgg(self.fig, master=self.results_frame)
+        self.canvas.get_tk_widget().grid(column=0, row=1, pady=20, columnspan=2)
+        self.canvas.mpl_connect('pick_event', self.on_chart_click)
+
     def create_pivot_chart(self):
-        df = self.df[self.df['Promo Type'] != '']
-        df['Promo Type'] = df['Promo Type'].apply(lambda x: 'Multibuy' if 'Multibuy' in x else x)
-        pivot_table = df.pivot_table(index='Promo Type', values=['Line: Quantity', 'Line: Total'], aggfunc='sum')
-        pivot_table = pivot_table.sort_values(by='Line: Total', ascending=False)
+        # Served from the aggregate cube, so redrawing or drilling down never rescans the lines
+        import promo_engine
 
-        self.ax.clear()
-        labels = pivot_table.index.to_numpy()
-        data = pivot_table['Line: Total'].to_numpy()
-        wedges, texts, autotexts = self.ax.pie(data, labels=labels, autopct='%1.0f%%', pctdistance=0.85)
+        if self.drill_slice is None:
+            pivot_table = promo_engine.chart_table(self.cube)
+            title = "Promo Distribution"
+        else:
+            pivot_table = promo_engine.chart_drill_down(self.cube, self.drill_slice, 'Tier Group')
+            title = f"{self.drill_slice} by Tier Group"
+        if self.preview is not None:
+            title += " (preview)"
+
+        self.ensure_chart()
 
-        self.ax.set_title("Promo Distribution", fontsize=16)
+        self.ax.clear()
+        slices = promo_engine.pie_slices(pivot_table)
+        labels = slices.index.to_numpy()
+        data = slices['Line: Total'].to_numpy()
+        wedges = self.ax.pie(data, labels=labels, autopct='%1.0f%%', pctdistance=0.85)[0] if len(slices) else []
+        for wedge, label in zip(wedges, labels):
+            wedge.set_picker(True)
+            wedge.promo_slice = label
+
+        self.ax.set_title(title, fontsize=16)
         self.fig.tight_layout()
         self.canvas.draw()
 
-        result_text = "Promo Distribution:\n\n"
+        result_text = f"{title}:\n\n"
         for promo, total in zip(pivot_table.index, pivot_table['Line: Total']):
-            result_text += f"{promo}: ${total:.2f}\n"
+            if self.preview is None:
+                result_text += f"{promo}: ${total:.2f}\n"
+            elif self.drill_slice is None and promo in self.preview.index:
+                share, low, high = self.preview.loc[promo, ['Share', 'Share Low', 'Share High']]
+                result_text += f"{promo}: about ${total:,.0f}, {share:.1%} of sales (95% CI {low:.1%} to {high:.1%})\n"
+            else:
+                result_text += f"{promo}: about ${total:,.0f}\n"
+        if self.preview is not None:
+            result_text += f"\n{self.preview_note}\n"
+        if self.drill_slice is None:
+            result_text += "\nClick a slice to split it by tier group."
+        else:
+            result_text += "\nClick any slice to go back to all promos."
 
         self.result_text.delete(1.0, tk.END)
         self.result_text.insert(tk.END, result_text)
 
-    # Promo analysis functions (unchanged)
-    def analyze_taf25(self, df):
-        df['Discount Ratio'] = (df['Line: Discount per Item'].abs() / df['Line: Price']).round(2)
-        mask = (df['Discount Ratio'] >= 0.24) & (df['Discount Ratio'] <= 0.26) & (df['Line: Variant Compare At Price'] > 0)
-        df.loc[mask, 'Promo Type'] = "TAF25"
-        df.drop(columns=['Discount Ratio'], inplace=True)
-        return df
-
-    def analyze_25_percent_off(self, df):
-        df['Discount Ratio'] = (df['Line: Discount per Item'].abs() / df['Line: Price']).round(2)
-        mask = (df['Discount Ratio'] >= 0.24) & (df['Discount Ratio'] <= 0.26) & (df['Line: Variant Compare At Price'] == 0)
-        df.loc[mask, 'Promo Type'] = "25% Off Selected Styles"
-        df.drop(columns=['Discount Ratio'], inplace=True)
-        return df
-
-    def analyze_gift_card(self, df):
-        mask = df['Line: Title'] == 'Gift Card'
-        df.loc[mask, 'Promo Type'] = "Gift Card"
-        return df
-
-    def analyze_md_purchase(self, df):
-        mask = (df['Line: Type'] == 'Line Item') & (~df['Line: Variant Compare At Price'].isnull()) & (df['Line: Variant Compare At Price'] != 0)
-        df.loc[mask, 'Promo Type'] = "MD Purchase"
-        return df
-
-    def analyze_promo_code(self, df):
-        promo_code_ids = set()
-        promo_code_mask = df['Line: Name'].isin(['UNIDAYS', 'UNIDAYS20'])
-        non_line_item_mask = df['Line: Type'] != 'Line Item'
-        promo_code_ids.update(df.loc[promo_code_mask & non_line_item_mask, 'ID'].tolist())
-        df.loc[df['ID'].isin(promo_code_ids), 'Promo Type'] = "Promo Code"
-        return df
-
-    def analyze_50_50(self, df):
-        mask_not_null = df['Line: Product Tags'].notnull()
-        mask = mask_not_null & df['Line: Product Tags'].str.contains(r'\b5050Jul24\b', case=False, regex=True)
-        df.loc[mask, 'Promo Type'] = "50% Off 50 Styles"
-        return df
-
-    def analyze_sublime_suits(self, df):
-        mask = df['Line: Product Tags'].str.contains(r'\bautomatic:(\$399|\$599) Suits\b', case=False) & \
-               df['Line: Discount per Item'].isin([-174.50, -199.50, -249.50])
-        df.loc[mask, 'Promo Type'] = "$399 & $599 Suits"
-        return df
-
-    def analyze_chino_25_percent_off(self, df):
-        df['Discount Ratio'] = (df['Line: Discount per Item'].abs() / df['Line: Price']).round(2)
-        mask = (df['Discount Ratio'] >= 0.24) & (df['Discount Ratio'] <= 0.26) & df['Line: Product Type'].str.contains('Chino', case=False) & (df['Line: Variant Compare At Price'] == 0)
-        df.loc[mask, 'Promo Type'] = "25% Off Chinos"
-        df.drop(columns=['Discount Ratio'], inplace=True)
-        return df
-
-    def analyze_25_percent_off_coats(self, df):
-        df['Discount Ratio'] = (df['Line: Discount per Item'].abs() / df['Line: Price']).round(2)
-        mask = (df['Discount Ratio'] >= 0.24) & (df['Discount Ratio'] <= 0.26) & df['Line: Product Type'].str.contains('Outerwear', case=False) & (df['Line: Variant Compare At Price'] == 0)
-        df.loc[mask, 'Promo Type'] = "25% Off Coats/Outerwear"
-        df.drop(columns=['Discount Ratio'], inplace=True)
-        return df
-
-    def analyze_25_percent_off_winter_tailoring(self, df):
-        df['Discount Ratio'] = (df['Line: Discount per Item'].abs() / df['Line: Price']).round(2)
-        mask = (
-                (df['Discount Ratio'] >= 0.24) &
-                (df['Discount Ratio'] <= 0.26) &
-                (df['Line: Product Tags'].str.contains(r'\b25OFFWINTERTAILORING\b', case=False, regex=True)) &
-                (df['Line: Variant Compare At Price'] == 0)
-        )
-        df.loc[mask, 'Promo Type'] = "25% Off Tailoring"
-        df.drop(columns=['Discount Ratio'], inplace=True)
-        return df
-
-    def analyze_40_percent_off_tailoring(self, df):
-        df['Discount Ratio'] = (df['Line: Discount per Item'].abs() / df['Line: Price']).round(2)
-        mask = (
-                (df['Discount Ratio'] >= 0.39) &
-                (df['Discount Ratio'] <= 0.41) &
-                (df['Line: Product Tags'].str.contains(r'\b40_Off_Tailoring_May24\b', case=False, regex=True)) &
-                (df['Line: Variant Compare At Price'] == 0)
-        )
-        df.loc[mask, 'Promo Type'] = "40% Off Tailoring"
-        df.drop(columns=['Discount Ratio'], inplace=True)
-        return df
-
-    def analyze_25_percent_off_knits(self, df):
-        df['Discount Ratio'] = (df['Line: Discount per Item'].abs() / df['Line: Price']).round(2)
-        mask = (df['Discount Ratio'] >= 0.24) & (df['Discount Ratio'] <= 0.26) & df['Line: Product Type'].str.contains('Knitwear', case=False) & (df['Line: Variant Compare At Price'] == 0)
-        df.loc[mask, 'Promo Type'] = "Knits Offer"
-        df.drop(columns=['Discount Ratio'], inplace=True)
-        return df
-
-    def analyze_tee_multibuy(self, df):
-        mask = df['Line: Title'].str.contains("Mattia", case=False) & (df['Line: Total'] % 40 == 0) & (df['Line: Total'] != 0)
-        df.loc[mask, 'Promo Type'] = "Tee Multibuy"
-        return df
-
-    def analyze_shirts_multibuy(self, df):
-        mask = df['Line: Product Type'].str.contains('Shirts', case=False) & (df['Line: Discount per Item'] == -30)
-        df.loc[mask, 'Promo Type'] = "Shirts Multibuy"
-        return df
-
-    def analyze_chino_multibuy(self, df):
-        mask = df['Line: Product Tags'].str.contains(r'\bdiscount:2_each_\$110\b', case=False, regex=True) & (df['Line: Total'] % 110 == 0)
-        df.loc[mask, 'Promo Type'] = "Chino Multibuy"
-        return df
-
-    def analyze_linen_shirts_multibuy(self, df):
-        mask = df['Line: Product Tags'].str.contains(r'\bdiscount:2_each_\$130\b', case=False, regex=True) & (df['Line: Total'] % 130 == 0)
-        df.loc[mask, 'Promo Type'] = "Linen Shirts Multibuy"
-        return df
-
-    def analyze_polo_multibuy(self, df):
-        mask = df['Line: Product Tags'].str.contains(r'\bdiscount:2_each_\$109\b', case=False, regex=True) & (df['Line: Total'] % 109.99 == 0)
-        df.loc[mask, 'Promo Type'] = "Polo Multibuy"
-        return df
-
-    def analyze_casual_bottom_multibuy(self, df):
-        df['Discount Ratio'] = (df['Line: Discount per Item'].abs() / df['Line: Price']).round(2)
-        mask = (df['Discount Ratio'] >= 0.29) & (df['Discount Ratio'] <= 0.31) & df['Line: Product Type'].str.contains('Chino', case=False) & (df['Line: Variant Compare At Price'] == 0)
-        df.loc[mask, 'Promo Type'] = "Casual Bottom Multibuy"
-        df.drop(columns=['Discount Ratio'], inplace=True)
-        return df
-
-    def analyze_fp_purchase(self, df):
-        df_filtered = df[df['Promo Type'] != 'Promo Code']
-        fp_purchase_mask = df['Line: Variant Compare At Price'] == 0
-        fp_purchase_mask &= (df['Line: Discount'] == 0) & (df['Line: Discount per Item'] == 0)
-        df.loc[fp_purchase_mask, 'Promo Type'] = 'FP Purchase'
-        return df
-
-    def analyze_suit_multibuy(self, df):
-        # Define the suit multibuy prices
-        suit_multibuy_prices = [175, 200, 275, 350, 400, 425, 575, 700]
-
-        # Apply Suit Multibuy tag
-        mask = (df['Line: Title'].str.contains('Jacket|Trouser', case=False, na=False)) & \
-               (df['Line: Total'].isin(suit_multibuy_prices))
-        df.loc[mask, 'Promo Type'] = 'Suit Multibuy'
-        return df
-
-    def get_tier_group(self, tags):
-        if pd.isna(tags):
-            return 'Silver'
-        if 'cx-tier-tier-1' in tags:
-            return 'Silver'
-        elif 'cx-tier-tier-2' in tags:
-            return 'Gold'
-        elif 'cx-tier-tier-3' in tags:
-            return 'Platinum'
-        else:
-            return 'Silver'
+    def on_chart_click(self, event):
+        # A click on a promo slice splits it by tier; a click on the split chart goes back
+        self.drill_slice = event.artist.promo_slice if self.drill_slice is None else None
+        self.create_pivot_chart()
 
-    def drop_shipping_lines(self, df):
-        return df[df['Line: Type'] != 'Shipping Line']
 
-    def drop_discount_lines(self, df):
-        return df[df['Line: Type'] != 'Discount']
+def warm_up():
+    # Import the heavy modules on a background thread; later imports are then just lookups
+    for name in HEAVY_MODULES:
+        importlib.import_module(name)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="M.J. BALE Promo Analysis Tool")
+    parser.add_argument("--startup-check", action="store_true",
+                        help=f"report how long the window takes to appear and exit non-zero "
+                             f"if it exceeds {STARTUP_BUDGET_S:.1f}s")
+    parser.add_argument("--profile-dir", metavar="DIR",
+                        help="write a per-stage timing/memory report (<name>_profile.json) after each run")
+    parser.add_argument("--cprofile", action="store_true",
+                        help="with --profile-dir, also dump cProfile stats (<name>.prof)")
+    parser.add_argument("--no-profile-memory", action="store_false", dest="profile_memory",
+                        help="skip the per-stage memory tracking, which slows parsing down noticeably")
+    args = parser.parse_args(argv)
 
-if __name__ == "__main__":
     root = tk.Tk()
-    app = PromoAnalysisTool(root)
-    root.mainloop()
\ No newline at end of file
+    app = PromoAnalysisTool(root, args.profile_dir, args.cprofile, args.profile_memory)
+
+    if args.startup_check:
+        root.update()
+        elapsed = time.perf_counter() - STARTED_AT
+        print(f"Window ready in {elapsed:.3f}s (budget {STARTUP_BUDGET_S:.1f}s)")
+        root.destroy()
+        return 0 if elapsed <= STARTUP_BUDGET_S else 1
+
+    root.mainloop()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
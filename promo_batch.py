@@ -0,0 +1,165 @@
+"""Headless batch runner: classify many Shopify exports in parallel without the Tk app.
+
+Example:
+    python promo_batch.py exports/*.xlsx --output-dir analysed --promo "Chino Multibuy" --promo "FP Purchase"
+"""
+import argparse
+import glob
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from promo_cache import CACHE_DIR, ExportCache
+from promo_catalog import DEFAULT_PROMOS
+from promo_engine import PROMO_RULES, SplitOrderError, analyze_path, check_promos, iter_analyzed_chunks
+from promo_export import CHART_MODES, CHART_NATIVE, OVERFLOW_ERROR, OVERFLOW_MODES, save_workbook, write_workbook
+from promo_profile import NO_PROFILE, RunProfile
+from promo_store import STORE_PATH, ResultStore
+
+
+def file_stem(file_path):
+    return os.path.splitext(os.path.basename(file_path))[0]
+
+
+def output_path_for(file_path, output_dir):
+    return os.path.join(output_dir, f"{file_stem(file_path)}_analysed.xlsx")
+
+
+def process_file(file_path, output_dir, promos, chunksize=None, cache_dir=None, overflow=OVERFLOW_ERROR,
+                 chart=CHART_NATIVE, profile_dir=None, cprofile=False, profile_memory=True, store_path=None):
+    # Runs in a worker process: one classified workbook (raw sheet + pivot) per input file.
+    # With a chunksize the file is streamed through classification and into the workbook.
+    # With a profile_dir, a per-stage report (and optionally a cProfile dump) is written there too.
+    # With a store_path, orders already classified unchanged in an earlier run are reused.
+    store = ResultStore(store_path) if store_path else None
+    try:
+        if profile_dir:
+            with RunProfile(label=file_path, track_memory=profile_memory, cprofile=cprofile) as profile:
+                result = _process_file(file_path, output_dir, promos, chunksize, cache_dir, overflow, chart,
+                                       profile, store)
+            profile.save(profile_dir, file_stem(file_path))
+            return result
+        return _process_file(file_path, output_dir, promos, chunksize, cache_dir, overflow, chart, store=store)
+    finally:
+        if store is not None:
+            store.close()
+
+
+def _process_file(file_path, output_dir, promos, chunksize, cache_dir, overflow, chart, profile=NO_PROFILE,
+                  store=None):
+    out_path = output_path_for(file_path, output_dir)
+    if chunksize:
+        chunks = iter_analyzed_chunks(file_path, promos, chunksize, profile=profile, store=store)
+        try:
+            write_workbook(chunks, out_path, overflow, chart=chart, profile=profile)
+            return out_path, None
+        except SplitOrderError as e:
+            # Orders out of sequence can't be streamed; classify the whole sheet at once instead
+            print(f"{file_path}: {e}; reading it whole", file=sys.stderr)
+    cache = ExportCache(cache_dir) if cache_dir else None
+    df = analyze_path(file_path, promos, cache=cache, profile=profile, store=store)
+    save_workbook(df, out_path, overflow, chart, profile=profile)
+    return out_path, len(df)
+
+
+def expand_inputs(patterns):
+    # Expand globs ourselves so quoting works the same on Windows shells; a directory stands
+    # for the .xlsx files in it
+    files = []
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            # Skipping the ~$ lock files Excel leaves next to open workbooks
+            matches = sorted(path for path in glob.glob(os.path.join(pattern, '*.xlsx'))
+                             if not os.path.basename(path).startswith('~$'))
+        else:
+            matches = sorted(glob.glob(pattern)) if glob.has_magic(pattern) else [pattern]
+        files.extend(matches)
+    return list(dict.fromkeys(files))
+
+
+def add_common_arguments(parser):
+    # Options shared by the command-line tools that classify many exports (this one and promo_compare)
+    parser.add_argument("-p", "--promo", action="append", dest="promos", metavar="NAME",
+                        help="promo to apply (repeatable); defaults to the GUI's default selection")
+    parser.add_argument("--all-promos", action="store_true", help="apply every known promo")
+    parser.add_argument("-j", "--workers", type=int, default=None,
+                        help="worker processes (default: one per CPU core)")
+    parser.add_argument("--chunksize", type=int, default=None, metavar="ROWS",
+                        help="stream each export in chunks of about ROWS lines to bound memory")
+    parser.add_argument("--cache-dir", default=CACHE_DIR,
+                        help="where parsed exports are cached (default: %(default)s)")
+    parser.add_argument("--no-cache", action="store_true", help="always re-parse the exports")
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Classify Shopify order exports by promo type without the GUI.")
+    parser.add_argument("inputs", nargs="*", help="Excel exports (.xlsx), directories of them, or glob patterns")
+    parser.add_argument("-o", "--output-dir", default=".", help="directory for the analysed workbooks")
+    add_common_arguments(parser)
+    parser.add_argument("--overflow", choices=OVERFLOW_MODES, default=OVERFLOW_ERROR,
+                        help="when the lines don't fit on one Excel sheet: fail, split them over "
+                             "several sheets, or skip the raw-data sheet (default: %(default)s)")
+    parser.add_argument("--chart", choices=CHART_MODES, default=CHART_NATIVE,
+                        help="pie chart on the pivot sheet: a native Excel chart, an embedded "
+                             "PNG, or none (default: %(default)s)")
+    parser.add_argument("--incremental", action="store_true",
+                        help="keep results by order ID and only classify orders that are new or changed "
+                             "since an earlier run")
+    parser.add_argument("--store", default=STORE_PATH, metavar="PATH",
+                        help="results store for --incremental (default: %(default)s)")
+    parser.add_argument("--profile-dir", metavar="DIR",
+                        help="write a per-stage timing/memory report (<name>_profile.json) for each file here")
+    parser.add_argument("--cprofile", action="store_true",
+                        help="with --profile-dir, also dump cProfile stats (<name>.prof) for each file")
+    parser.add_argument("--no-profile-memory", action="store_false", dest="profile_memory",
+                        help="skip the per-stage memory tracking, which slows parsing down noticeably")
+    parser.add_argument("--list-promos", action="store_true", help="print the known promo names and exit")
+    return parser
+
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+
+    if args.list_promos:
+        for promo in PROMO_RULES:
+            print(promo)
+        return 0
+
+    promos = list(PROMO_RULES) if args.all_promos else (args.promos or DEFAULT_PROMOS)
+    try:
+        check_promos(promos)
+    except ValueError as e:
+        parser.error(str(e))
+
+    if args.cprofile and not args.profile_dir:
+        parser.error("--cprofile needs --profile-dir")
+
+    files = expand_inputs(args.inputs)
+    if not files:
+        parser.error("no input files")
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    cache_dir = None if args.no_cache else args.cache_dir
+
+    failures = 0
+    with ProcessPoolExecutor(max_workers=args.workers) as pool:
+        futures = {pool.submit(process_file, path, args.output_dir, promos, args.chunksize, cache_dir,
+                               args.overflow, args.chart, args.profile_dir, args.cprofile,
+                               args.profile_memory, args.store if args.incremental else None): path
+                   for path in files}
+        for future in as_completed(futures):
+            path = futures[future]
+            try:
+                out_path, rows = future.result()
+            except Exception as e:
+                failures += 1
+                print(f"FAILED {path}: {e}", file=sys.stderr)
+            else:
+                print(f"{path} -> {out_path}" + (f" ({rows} lines)" if rows is not None else ""))
+
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
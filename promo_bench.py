@@ -0,0 +1,184 @@
+"""Benchmark the analysis pipeline on synthetic exports and flag regressions against a baseline.
+
+Every size runs in its own worker process so its peak RSS isn't inflated by a previous,
+larger run. Stages: ingest (parsing an .xlsx), each promo rule on its own, tier grouping,
+the full classification, pivoting and the Excel export. A stage's own memory is its peak
+traced allocation (tracemalloc) in one extra run, kept apart from the timed runs because
+tracing slows Python-heavy stages down several times.
+
+Example:
+    python promo_bench.py --sizes 10000 100000 --save-baseline   # record a baseline
+    python promo_bench.py --sizes 10000 100000                   # compare; exit 1 on regression
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+from concurrent.futures import ProcessPoolExecutor
+
+try:
+    import resource
+except ImportError:  # Windows: no peak RSS
+    resource = None
+
+DEFAULT_SIZES = [10_000, 100_000, 1_000_000, 5_000_000]
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bench_baseline.json")
+
+TOLERANCE = 0.25  # allowed slowdown/growth relative to the baseline
+MIN_SECONDS_DELTA = 0.05  # ignore regressions smaller than timer noise
+MIN_MEMORY_DELTA_MB = 50
+
+
+def peak_rss_mb():
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports KiB, macOS bytes
+    return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def bench_size(rows, seed, ingest_max_rows, export_max_rows, repeat, stage_memory=True):
+    # Runs in a fresh worker process; returns {"peak_rss_mb": ..., "stages": {stage: {"seconds": ...,
+    # "peak_mb": ...}}}, peak_rss_mb being the whole process's high-water mark
+    import promo_engine
+    from promo_export import OVERFLOW_SPLIT, save_workbook
+    from promo_synth import generate_orders, write_export
+
+    results = {}
+
+    def timed(stage, func):
+        best = None
+        for _ in range(repeat):
+            start = time.perf_counter()
+            value = func()
+            elapsed = time.perf_counter() - start
+            best = elapsed if best is None else min(best, elapsed)
+        results[stage] = {"seconds": round(best, 4), "peak_mb": traced_peak_mb(func) if stage_memory else None}
+        return value
+
+    df = promo_engine.normalize_export(generate_orders(rows, seed=seed))  # as read_export loads it
+    with tempfile.TemporaryDirectory() as tmp:
+        if rows <= ingest_max_rows:
+            source = os.path.join(tmp, "export.xlsx")
+            write_export(df, source)
+            timed("ingest", lambda: promo_engine.read_export(source))
+
+        # Each rule against fresh features, so it pays for everything it needs
+        for promo, rule in promo_engine.PROMO_RULES.items():
+            timed(f"rule: {promo}", lambda: rule(promo_engine.Features(df)))
+        timed("tier grouping", lambda: promo_engine.Features(df).tier_group())
+
+        classified = timed("classify", lambda: promo_engine.run_analysis(df.copy(), list(promo_engine.PROMO_RULES)))
+        timed("pivot", lambda: promo_engine.build_pivot_table(classified))
+
+        if rows <= export_max_rows:
+            target = os.path.join(tmp, "analysed.xlsx")
+            timed("export", lambda: save_workbook(classified, target, overflow=OVERFLOW_SPLIT))
+    return {"peak_rss_mb": peak_rss_mb(), "stages": results}
+
+
+def traced_peak_mb(func):
+    # Peak memory allocated while func runs, above what was allocated before it
+    tracemalloc.start()
+    try:
+        func()
+        current, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return round(peak / 1024 ** 2, 1)
+
+
+def compare(results, baseline, tolerance):
+    # Returns a list of human-readable regressions
+    regressions = []
+
+    def grew(value, base_value):
+        return value and base_value and value > base_value * (1 + tolerance) and value - base_value > MIN_MEMORY_DELTA_MB
+
+    for size, result in results.items():
+        base_result = baseline.get(size, {})
+        rss, base_rss = result["peak_rss_mb"], base_result.get("peak_rss_mb")
+        if grew(rss, base_rss):
+            regressions.append(f"{size} rows: peak RSS {rss:.0f}MB vs baseline {base_rss:.0f}MB")
+        for stage, measured in result["stages"].items():
+            base = base_result.get("stages", {}).get(stage)
+            if not base:
+                continue
+            seconds, base_seconds = measured["seconds"], base["seconds"]
+            if seconds > base_seconds * (1 + tolerance) and seconds - base_seconds > MIN_SECONDS_DELTA:
+                regressions.append(f"{size} rows, {stage}: {seconds:.3f}s vs baseline {base_seconds:.3f}s")
+            peak, base_peak = measured.get("peak_mb"), base.get("peak_mb")
+            if grew(peak, base_peak):
+                regressions.append(f"{size} rows, {stage}: peak {peak:.0f}MB vs baseline {base_peak:.0f}MB")
+    return regressions
+
+
+def print_table(results):
+    for size, result in results.items():
+        rss = result["peak_rss_mb"]
+        print(f"\n{int(size):,} rows" + (f" (peak RSS {rss:.0f} MB)" if rss is not None else ""))
+        for stage, measured in result["stages"].items():
+            peak = measured["peak_mb"]
+            peak_text = f"{peak:8.1f} MB" if peak is not None else ""
+            print(f"  {stage:<36} {measured['seconds']:9.3f}s {peak_text}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the promo pipeline on synthetic exports.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=DEFAULT_SIZES, help="rows per synthetic export")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=1, help="runs per stage; the fastest is kept")
+    parser.add_argument("--ingest-max-rows", type=int, default=1_000_000,
+                        help="skip the .xlsx ingest stage above this size")
+    parser.add_argument("--export-max-rows", type=int, default=1_000_000,
+                        help="skip the Excel export stage above this size")
+    parser.add_argument("--no-stage-memory", action="store_false", dest="stage_memory",
+                        help="skip the extra traced run that measures each stage's peak memory")
+    parser.add_argument("--baseline", default=BASELINE_PATH, help="baseline JSON (default: %(default)s)")
+    parser.add_argument("--save-baseline", action="store_true", help="store these results as the new baseline")
+    parser.add_argument("--tolerance", type=float, default=TOLERANCE,
+                        help="allowed regression as a fraction of the baseline (default: %(default)s)")
+    parser.add_argument("--output", help="also write the results as JSON to this path")
+    args = parser.parse_args(argv)
+
+    results = {}
+    for rows in args.sizes:
+        with ProcessPoolExecutor(max_workers=1) as pool:
+            results[str(rows)] = pool.submit(bench_size, rows, args.seed, args.ingest_max_rows,
+                                             args.export_max_rows, args.repeat, args.stage_memory).result()
+    print_table(results)
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+    if args.save_baseline:
+        baseline = {}
+        if os.path.exists(args.baseline):
+            with open(args.baseline) as f:
+                baseline = json.load(f)
+        baseline.update(results)
+        with open(args.baseline, "w") as f:
+            json.dump(baseline, f, indent=2)
+        print(f"\nBaseline saved to {args.baseline}")
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print(f"\nNo baseline at {args.baseline}; run with --save-baseline to record one")
+        return 0
+    with open(args.baseline) as f:
+        regressions = compare(results, json.load(f), args.tolerance)
+    if regressions:
+        print("\nRegressions:")
+        for regression in regressions:
+            print(f"  {regression}")
+        return 1
+    print("\nNo regressions against the baseline")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
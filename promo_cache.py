@@ -0,0 +1,114 @@
+"""Content-addressed on-disk cache of parsed exports in Arrow IPC (Feather) format.
+
+Parsing a large .xlsx takes minutes; reloading the same export from an uncompressed Arrow
+file is a memory-mapped read. Entries are keyed by the SHA-256 of the source file, so an
+edited export never hits a stale entry, and the cache is trimmed least-recently-used first.
+"""
+import hashlib
+import os
+import tempfile
+
+import pyarrow as pa
+import pyarrow.feather as feather
+
+CACHE_DIR = os.environ.get('PROMO_CACHE_DIR') or os.path.join(os.path.expanduser('~'), '.cache', 'promo_analysis')
+MAX_CACHE_BYTES = 2 * 1024 ** 3
+
+
+def file_digest(file_path):
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _remove(path):
+    # Another batch worker may have evicted the same file first
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+class ExportCache:
+    def __init__(self, cache_dir=CACHE_DIR, max_bytes=MAX_CACHE_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.sources_dir = os.path.join(cache_dir, 'sources')
+        os.makedirs(self.sources_dir, exist_ok=True)
+
+    def entry_path(self, key):
+        return os.path.join(self.cache_dir, key + '.arrow')
+
+    def load(self, file_path, reader):
+        # Return the parsed frame for file_path, calling reader(file_path) only on a cache miss
+        key = file_digest(file_path)
+        entry = self.entry_path(key)
+        if os.path.exists(entry):
+            try:
+                df = feather.read_table(entry, memory_map=True).to_pandas()
+            except (OSError, pa.ArrowException):
+                pass  # truncated or corrupt entry: parse again and overwrite it
+            else:
+                os.utime(entry)  # mark as recently used for LRU eviction
+                self._remember_source(file_path, key)
+                return df
+
+        df = reader(file_path)
+        if self._store(key, df):
+            self._remember_source(file_path, key)
+            self.evict(keep=key)
+        return df
+
+    def _store(self, key, df):
+        # Write to a temp file and rename, so concurrent batch workers never see half an entry
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_dir, suffix='.tmp')
+        os.close(fd)
+        try:
+            feather.write_feather(df, tmp_path, compression='uncompressed')
+            os.replace(tmp_path, self.entry_path(key))
+        except (pa.ArrowException, ValueError, TypeError):
+            # Columns pyarrow can't type (e.g. numbers mixed with text) just aren't cached
+            _remove(tmp_path)
+            return False
+        return True
+
+    def _remember_source(self, file_path, key):
+        # One small pointer file per source path; when the source changes, drop its old entry
+        pointer = os.path.join(self.sources_dir, hashlib.sha1(os.path.abspath(file_path).encode()).hexdigest())
+        old_key = None
+        if os.path.exists(pointer):
+            with open(pointer) as f:
+                old_key = f.read().strip()
+        if old_key == key:
+            return
+        with open(pointer, 'w') as f:
+            f.write(key)
+        if old_key:
+            _remove(self.entry_path(old_key))
+
+    def evict(self, keep=None):
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            if name.endswith('.arrow'):
+                path = os.path.join(self.cache_dir, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, path))
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            if keep and path == self.entry_path(keep):
+                continue
+            _remove(path)
+            total -= size
+
+    def clear(self):
+        for name in os.listdir(self.cache_dir):
+            if name.endswith('.arrow'):
+                _remove(os.path.join(self.cache_dir, name))
@@ -0,0 +1,32 @@
+"""Promo names, defaults and precedence, kept free of heavy imports so the GUI can start fast."""
+
+DEFAULT_PROMOS = ["Chino Multibuy", "FP Purchase", "Gift Card", "Linen Shirts Multibuy",
+                  "MD Purchase", "Polo Multibuy", "Promo Code", "Shirts Multibuy",
+                  "Suit Multibuy", "Tee Multibuy"]
+
+# Highest priority first: when several selected promos match a line, the earliest one here wins.
+# This is the order the old sequential analyze_* rewrites resolved to (last writer wins).
+PROMO_PRIORITY = [
+    "Tee Multibuy",
+    "TAF25",
+    "Suit Multibuy",
+    "Shirts Multibuy",
+    "Promo Code",
+    "Polo Multibuy",
+    "MD Purchase",
+    "Linen Shirts Multibuy",
+    "Knits Offer",
+    "Gift Card",
+    "FP Purchase",
+    "Chino Multibuy",
+    "Casual Bottom Multibuy",
+    "50% Off 50 Styles",
+    "40% Off Tailoring",
+    "25% Off Tailoring",
+    "25% Off Selected Styles",
+    "25% Off Coats/Outerwear",
+    "25% Off Chinos",
+    "$399 & $599 Suits",
+]
+
+PROMO_NAMES = sorted(PROMO_PRIORITY)
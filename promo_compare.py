@@ -0,0 +1,123 @@
+"""Promo mix over time: classify many period exports in parallel and compare them side by side.
+
+Each export (e.g. one per week) is one period. Workers send back only that period's sales and
+quantity per promo, not the classified lines, and the results land in one workbook with a
+period x promo table and chart per measure, so cannibalization of FP Purchase and MD Purchase
+sales by a campaign shows up as bands trading places.
+
+Example:
+    python promo_compare.py weekly_exports/ -o promo_mix_2024.xlsx --all-promos
+"""
+import argparse
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import pandas as pd
+
+from promo_batch import add_common_arguments, expand_inputs, file_stem
+from promo_cache import ExportCache
+from promo_catalog import DEFAULT_PROMOS
+from promo_engine import (PROMO_RULES, analyze_path, analyze_path_chunked, build_cube, check_promos,
+                          cube_totals)
+from promo_export import write_comparison_workbook
+
+
+def summarize_export(file_path, promos, chunksize=None, cache_dir=None):
+    # Runs in a worker process and returns a few hundred bytes however big the export is:
+    # the period's name and order date range, and sales $ / quantity per promo
+    if chunksize:
+        cube = analyze_path_chunked(file_path, promos, chunksize)
+    else:
+        cache = ExportCache(cache_dir) if cache_dir else None
+        cube = build_cube(analyze_path(file_path, promos, cache=cache))
+
+    dates = cube.index.get_level_values('Order Date')
+    totals = cube_totals(cube)
+    totals = totals[totals.index != '']  # unclassified lines, left out as on the pivot sheet
+    names = [str(promo) for promo in totals.index]
+    return {
+        'period': file_stem(file_path),
+        'start': dates.min() if len(dates) else pd.NaT,
+        'end': dates.max() if len(dates) else pd.NaT,
+        'sales': dict(zip(names, totals['Line: Total'].astype(float))),
+        'quantity': dict(zip(names, totals['Line: Quantity'].astype(float))),
+    }
+
+
+def comparison_tables(summaries):
+    # Period x promo frames for sales $ and quantity, periods in date order (then by name) and
+    # promos by total sales over all periods, largest first
+    def order(summary):
+        start = summary['start']
+        return (pd.Timestamp(start) if pd.notna(start) else pd.Timestamp.max), summary['period']
+
+    summaries = sorted(summaries, key=order)
+    periods = [period_label(s) for s in summaries]
+    sales = pd.DataFrame([s['sales'] for s in summaries], index=periods).fillna(0)
+    quantity = pd.DataFrame([s['quantity'] for s in summaries], index=periods).fillna(0)
+    columns = sales.sum().sort_values(ascending=False, kind='stable').index
+    return sales[columns], quantity.reindex(columns=columns, fill_value=0)
+
+
+def period_label(summary):
+    # '2024-W01 (2024-01-01 - 2024-01-07)' for a file named 2024-W01.xlsx
+    if pd.isna(summary['start']):
+        return summary['period']
+    start, end = pd.Timestamp(summary['start']), pd.Timestamp(summary['end'])
+    span = f"{start:%Y-%m-%d}" if start == end else f"{start:%Y-%m-%d} - {end:%Y-%m-%d}"
+    return f"{summary['period']} ({span})"
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Compare the promo mix across period exports.")
+    parser.add_argument("inputs", nargs="*", help="Excel exports (.xlsx), directories of them, or glob patterns; "
+                                                  "each is one period")
+    parser.add_argument("-o", "--output", default="promo_comparison.xlsx",
+                        help="comparison workbook (default: %(default)s)")
+    add_common_arguments(parser)
+    return parser
+
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+
+    promos = list(PROMO_RULES) if args.all_promos else (args.promos or DEFAULT_PROMOS)
+    try:
+        check_promos(promos)
+    except ValueError as e:
+        parser.error(str(e))
+
+    files = expand_inputs(args.inputs)
+    if not files:
+        parser.error("no input files")
+
+    cache_dir = None if args.no_cache else args.cache_dir
+    output_dir = os.path.dirname(args.output)
+    if output_dir:
+        os.makedirs(output_dir, exist_ok=True)
+
+    summaries = []
+    failures = 0
+    with ProcessPoolExecutor(max_workers=args.workers) as pool:
+        futures = {pool.submit(summarize_export, path, promos, args.chunksize, cache_dir): path for path in files}
+        for future in as_completed(futures):
+            path = futures[future]
+            try:
+                summaries.append(future.result())
+            except Exception as e:
+                failures += 1
+                print(f"FAILED {path}: {e}", file=sys.stderr)
+            else:
+                print(f"{path}: ${sum(summaries[-1]['sales'].values()):,.2f}")
+
+    if summaries:
+        sales, quantity = comparison_tables(summaries)
+        write_comparison_workbook(sales, quantity, args.output)
+        print(f"{len(summaries)} periods -> {args.output}")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
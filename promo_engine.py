@@ -0,0 +1,646 @@
+"""GUI-free promo classification pipeline shared by the Tk app and the batch CLI."""
+import numpy as np
+import openpyxl
+import pandas as pd
+
+from promo_catalog import PROMO_PRIORITY
+from promo_profile import NO_PROFILE
+from promo_rules import PROMO_RULES  # promo name -> rule; rule(features) is its mask of lines
+
+# Rows per chunk in streaming mode; chunks are extended to the end of the order they stop in
+CHUNKSIZE = 50_000
+
+NUMERIC_COLUMNS = ['Line: Quantity', 'Line: Price', 'Line: Discount', 'Line: Discount per Item',
+                   'Line: Total', 'Line: Variant Compare At Price']
+
+# Repetitive text columns, held as categoricals: a small integer code per line instead of a string
+CATEGORY_COLUMNS = ['Line: Type', 'Line: Name', 'Line: Title', 'Line: Product Type', 'Line: Product Tags',
+                    'Customer: Tags']
+
+# Promo Type categories: '' (no promo) is code 0
+PROMO_CATEGORIES = [''] + list(PROMO_PRIORITY)
+
+# The aggregate cube every summary is served from: Sales $ and quantity per combination of these
+ORDER_DATE_COLUMN = 'Created At'
+CUBE_LEVELS = ['Promo Type', 'Tier Group', 'Line: Product Type', 'Order Date']
+CUBE_VALUES = ['Line: Total', 'Line: Quantity']
+
+# Preview estimates: orders classified for the sample, and the normal quantile of the
+# confidence intervals on each promo's sales share (95%)
+PREVIEW_ORDERS = 20_000
+CONFIDENCE_Z = 1.96
+
+
+class AnalysisCancelled(Exception):
+    pass
+
+
+class SplitOrderError(ValueError):
+    # An order's lines aren't contiguous in the sheet, so a chunked read would split the order
+    pass
+
+
+class TextIndex:
+    """Distinct values of a text column plus each row's code into them.
+
+    Tag columns repeat the same few thousand comma-separated strings across millions of
+    lines, so matching the distinct strings and broadcasting through the codes replaces a
+    full-column regex scan (or a row-wise apply) with one integer take.
+    """
+
+    def __init__(self, series):
+        if isinstance(series.dtype, pd.CategoricalDtype):
+            # Already factorized at load time (see normalize_export)
+            self.codes, self.uniques = series.cat.codes.to_numpy(), series.cat.categories
+        else:
+            self.codes, self.uniques = pd.factorize(series, use_na_sentinel=True)
+
+    def broadcast(self, per_unique, missing):
+        # Map one value per distinct string back to every row; blank cells (code -1) get `missing`
+        per_unique = np.append(np.asarray(per_unique), missing)
+        return per_unique[self.codes]
+
+    def contains(self, pattern):
+        hits = pd.Series(self.uniques, dtype=object).str.contains(pattern, case=False, regex=True, na=False)
+        return self.broadcast(hits.to_numpy(dtype=bool), False)
+
+    def map(self, func, missing):
+        return self.broadcast([func(value) for value in self.uniques], missing)
+
+    def map_categorical(self, func, missing):
+        # Same as map, as a Categorical built from the codes without touching any strings
+        mapped = np.array([func(value) for value in self.uniques] + [missing], dtype=object)
+        mapped_codes, categories = pd.factorize(mapped)
+        return pd.Categorical.from_codes(mapped_codes[self.codes], categories)
+
+
+class OrderIndex:
+    """Group index over order IDs for order-scoped rules.
+
+    Built once per dataset: every line gets the integer code of its order, and per-order
+    reductions are a single bincount over those codes, broadcast back to the lines.
+    """
+
+    def __init__(self, ids):
+        codes, uniques = pd.factorize(ids, use_na_sentinel=True)
+        # Lines without an ID share one extra group, as they would under ID.isin(...)
+        self.ngroups = len(uniques) + 1
+        self.codes = np.where(codes < 0, len(uniques), codes)
+
+    def sum(self, values, mask=None):
+        # Per-line total of `values` over the matching lines of the line's order
+        weights = np.nan_to_num(np.asarray(values, dtype=float))
+        if mask is not None:
+            weights = np.where(mask, weights, 0.0)
+        return np.bincount(self.codes, weights=weights, minlength=self.ngroups)[self.codes]
+
+    def any(self, mask):
+        # Per-line flag: does any line of the same order match?
+        return np.bincount(self.codes, weights=mask, minlength=self.ngroups)[self.codes] > 0
+
+
+class Features:
+    """Columns and derived values shared by the promo rules, computed at most once per dataset."""
+
+    def __init__(self, df):
+        self.df = df
+        self._cache = {}
+
+    def memo(self, key, compute):
+        if key not in self._cache:
+            self._cache[key] = compute()
+        return self._cache[key]
+
+    def values(self, column):
+        return self.memo(('values', column), lambda: self.df[column].to_numpy())
+
+    def isnull(self, column):
+        return self.memo(('isnull', column), lambda: self.df[column].isna().to_numpy())
+
+    def equals(self, column, value):
+        return self.memo(('equals', column, value), lambda: (self.df[column] == value).to_numpy())
+
+    def isin(self, column, values):
+        values = tuple(values)
+        return self.memo(('isin', column, values), lambda: self.df[column].isin(values).to_numpy())
+
+    def text_index(self, column):
+        return self.memo(('text_index', column), lambda: TextIndex(self.df[column]))
+
+    def contains(self, column, pattern):
+        # Case-insensitive regex search; blank cells never match
+        return self.memo(('contains', column, pattern), lambda: self.text_index(column).contains(pattern))
+
+    def orders(self):
+        return self.memo('orders', lambda: OrderIndex(self.df['ID']))
+
+    def order_quantity(self, mask):
+        # Units of the matching lines in each line's order
+        return self.orders().sum(self.values('Line: Quantity'), mask)
+
+    def tier_group(self):
+        return self.memo('tier_group',
+                         lambda: self.text_index('Customer: Tags').map_categorical(get_tier_group, 'Silver'))
+
+    def money(self, column):
+        # (cents, missing): the column as exact int64 cents, with blank or non-numeric cells as 0
+        # and flagged in `missing`. Equality and "multiple of $x" tests on cents have no float error.
+        def compute():
+            dollars = pd.to_numeric(self.df[column], errors='coerce').to_numpy(dtype=float)
+            missing = np.isnan(dollars)
+            return np.round(np.where(missing, 0, dollars) * 100).astype(np.int64), missing
+        return self.memo(('money', column), compute)
+
+    def money_is(self, column, *amounts):
+        # Lines where the column is one of the given dollar amounts
+        cents = tuple(round(amount * 100) for amount in amounts)
+        def compute():
+            values, missing = self.money(column)
+            return np.isin(values, cents) & ~missing
+        return self.memo(('money_is', column, cents), compute)
+
+    def money_multiple_of(self, column, amount):
+        unit = round(amount * 100)
+        def compute():
+            values, missing = self.money(column)
+            return (values % unit == 0) & ~missing
+        return self.memo(('money_multiple_of', column, unit), compute)
+
+    def discount_ratio(self):
+        def compute():
+            discount, discount_missing = self.money('Line: Discount per Item')
+            price, price_missing = self.money('Line: Price')
+            with np.errstate(divide='ignore', invalid='ignore'):
+                ratio = np.abs(discount) / price
+            return np.where(discount_missing | price_missing, np.nan, ratio).round(2)
+        return self.memo('discount_ratio', compute)
+
+    def ratio_between(self, low, high):
+        def compute():
+            ratio = self.discount_ratio()
+            return (ratio >= low) & (ratio <= high)
+        return self.memo(('ratio_between', low, high), compute)
+
+    def money_above(self, column, amount):
+        cents = round(amount * 100)
+        def compute():
+            values, missing = self.money(column)
+            return (values > cents) & ~missing
+        return self.memo(('money_above', column, cents), compute)
+
+    def money_nonzero(self, column):
+        def compute():
+            values, missing = self.money(column)
+            return (values != 0) & ~missing
+        return self.memo(('money_nonzero', column), compute)
+
+
+def get_tier_group(tags):
+    if pd.isna(tags):
+        return 'Silver'
+    if 'cx-tier-tier-1' in tags:
+        return 'Silver'
+    elif 'cx-tier-tier-2' in tags:
+        return 'Gold'
+    elif 'cx-tier-tier-3' in tags:
+        return 'Platinum'
+    else:
+        return 'Silver'
+
+
+def check_promos(promos):
+    unknown = [promo for promo in promos if promo not in PROMO_RULES]
+    if unknown:
+        raise ValueError(f"Unknown promo(s): {', '.join(unknown)}")
+
+
+def normalize_export(df):
+    # Load-time representation: repetitive text as categoricals (several times smaller than
+    # Python strings, and rules only look at the distinct values). Money stays in dollars for
+    # the sheets; rules read it as exact cents through Features.money.
+    for column in CATEGORY_COLUMNS:
+        if column in df.columns and df[column].dtype == object:
+            df[column] = df[column].astype('category')
+    return df
+
+
+def read_export(file_path, cache=None):
+    # `cache` is an optional promo_cache.ExportCache; repeat loads of the same export skip the parse
+    if cache is not None:
+        return load_cached(cache, file_path, lambda path: pd.read_excel(path))
+    return normalize_export(pd.read_excel(file_path))
+
+
+def load_cached(cache, file_path, reader):
+    # cache.load, normalized: entries cached before normalize_export existed still hold object
+    # columns, and normalizing an already normalized frame costs nothing
+    return normalize_export(cache.load(file_path, reader))
+
+
+def _chunk_frame(rows, header):
+    df = pd.DataFrame.from_records(rows, columns=header)
+    # A chunk where a money column happens to be blank throughout would otherwise stay object dtype
+    for column in NUMERIC_COLUMNS:
+        if column in df.columns:
+            df[column] = pd.to_numeric(df[column], errors='coerce')
+    return df
+
+
+def export_row_count(file_path):
+    # Data rows according to the sheet's stored dimensions; None when the writer didn't record them
+    workbook = openpyxl.load_workbook(file_path, read_only=True)
+    try:
+        max_row = workbook.worksheets[0].max_row
+    finally:
+        workbook.close()
+    return max_row - 1 if max_row else None
+
+
+def iter_export_chunks(file_path, chunksize=CHUNKSIZE, check_orders=True):
+    # Stream the first sheet row by row (openpyxl read-only mode) and yield DataFrames of
+    # about `chunksize` rows. A chunk only ends where the order ID changes, so every order
+    # lands whole in one chunk; Shopify exports list each order's lines contiguously. With
+    # check_orders, an order that turns up again after its chunk was yielded raises
+    # SplitOrderError rather than being classified in two pieces.
+    closed = None  # sorted IDs of the orders in chunks already yielded
+
+    def finish_chunk(buffer):
+        nonlocal closed
+        chunk = _chunk_frame(buffer, header)
+        if check_orders:
+            ids = chunk['ID'].dropna().unique()
+            if closed is not None:
+                reopened = ids[np.isin(ids, closed)]
+                if len(reopened):
+                    raise SplitOrderError(f"Order {reopened[0]} appears again after its earlier lines were "
+                                          f"read; its lines aren't contiguous, so the export can't be "
+                                          f"streamed in chunks")
+            closed = ids if closed is None else np.union1d(closed, ids)
+        return chunk
+
+    workbook = openpyxl.load_workbook(file_path, read_only=True, data_only=True)
+    try:
+        rows = workbook.worksheets[0].iter_rows(values_only=True)
+        header = next(rows, None)
+        if header is None:
+            return
+        header = [name if name is not None else f"Unnamed: {i}" for i, name in enumerate(header)]
+        id_index = header.index('ID')
+
+        buffer = []
+        for row in rows:
+            if all(value is None for value in row):
+                continue
+            if len(buffer) >= chunksize and row[id_index] != buffer[-1][id_index]:
+                yield finish_chunk(buffer)
+                buffer = []
+            buffer.append(row)
+        if buffer:
+            yield finish_chunk(buffer)
+    finally:
+        workbook.close()
+
+
+def ranked_promos(promos):
+    # The rules a selection applies, highest priority first. Suit Multibuy (the old second_check)
+    # and FP Purchase are always applied on top of the selection.
+    check_promos(promos)
+    ranked = ["Suit Multibuy", "FP Purchase"]
+    ranked += [promo for promo in PROMO_PRIORITY if promo in promos and promo not in ranked]
+    return ranked
+
+
+def classify(features, promos, progress=None, profile=NO_PROFILE):
+    # Evaluate every selected rule once and resolve overlaps in a single np.select pass
+    ranked = ranked_promos(promos)
+    conditions = []
+    # Lines already taken by a higher-ranked rule; only tracked when profiling
+    claimed = np.zeros(len(features.df), dtype=bool) if profile is not NO_PROFILE else None
+    for i, promo in enumerate(ranked):
+        with profile.stage(f"rule: {promo}", rows_in=len(features.df)) as stage:
+            mask = PROMO_RULES[promo](features)
+            if claimed is not None:
+                stage['rows_matched'] = np.count_nonzero(mask)
+                stage['rows_tagged'] = np.count_nonzero(mask & ~claimed)
+                stage['rows_overridden'] = stage['rows_matched'] - stage['rows_tagged']
+                claimed |= mask
+        conditions.append(mask)
+        if progress is not None:
+            progress(i + 1, len(ranked))
+    with profile.stage("resolve priorities", rows_in=len(features.df)):
+        return promo_categorical(conditions, ranked)
+
+
+def promo_categorical(conditions, ranked):
+    # Promo Type codes straight from the masks: the first matching rule wins, '' when none does
+    codes = np.select(conditions, [PROMO_CATEGORIES.index(promo) for promo in ranked], default=0)
+    return pd.Categorical.from_codes(codes, PROMO_CATEGORIES)
+
+
+# Bit of each rule in a match_rules bitmask
+RULE_BITS = {promo: bit for bit, promo in enumerate(PROMO_PRIORITY)}
+if len(RULE_BITS) > 63:  # the bitmask is int64 and its sign bit stays clear
+    raise ValueError(f"{len(RULE_BITS)} rules don't fit in a 63-bit match_rules bitmask")
+
+
+def match_rules(features, promos=PROMO_PRIORITY, profile=NO_PROFILE):
+    # Every rule a line matches as a bitmask (see RULE_BITS), independent of any selection;
+    # resolve_matches turns it into the Promo Type classify would give for a selection
+    matched = np.zeros(len(features.df), dtype=np.int64)
+    for promo in promos:
+        with profile.stage(f"rule: {promo}", rows_in=len(features.df)):
+            matched |= PROMO_RULES[promo](features).astype(np.int64) << RULE_BITS[promo]
+    return matched
+
+
+def resolve_matches(matched, promos):
+    ranked = ranked_promos(promos)
+    conditions = [(matched >> RULE_BITS[promo]) & 1 == 1 for promo in ranked]
+    return promo_categorical(conditions, ranked)
+
+
+def read_export_streamed(file_path, progress=None, cancel=None, chunksize=10_000, partial=None):
+    # Same frame as read_export, parsed in chunks so long reads can report and be stopped.
+    # `progress(rows_read, total_rows)` follows every chunk (total_rows may be None);
+    # `cancel` is a threading.Event checked between chunks; `partial(chunks, total_rows)`
+    # gets the chunks read so far (whole orders, see concat_chunks) after every chunk.
+    total_rows = export_row_count(file_path) if progress is not None or partial is not None else None
+    chunks = []
+    rows_read = 0
+    # Every chunk is kept and concatenated, so an order split across chunks ends up whole anyway
+    for chunk in iter_export_chunks(file_path, chunksize, check_orders=False):
+        if cancel is not None and cancel.is_set():
+            raise AnalysisCancelled()
+        chunks.append(chunk)
+        rows_read += len(chunk)
+        if progress is not None:
+            progress(rows_read, total_rows)
+        if partial is not None:
+            partial(chunks, total_rows)
+    return concat_chunks(chunks)
+
+
+def concat_chunks(chunks):
+    if not chunks:
+        return pd.DataFrame()
+    return normalize_export(pd.concat(chunks, ignore_index=True))
+
+
+def run_analysis(df, promos, progress=None, cancel=None, profile=NO_PROFILE):
+    # `progress`, when given, is called as progress(step, total_steps) after every stage;
+    # `cancel` is an optional threading.Event that stops the run with AnalysisCancelled;
+    # `profile` is a promo_profile.RunProfile recording each stage
+    check_promos(promos)
+    total_steps = len(set(promos) | {"Suit Multibuy", "FP Purchase"}) + 3  # +3 for the steps after classification
+    step = 0
+
+    def advance():
+        nonlocal step
+        if cancel is not None and cancel.is_set():
+            raise AnalysisCancelled()
+        step += 1
+        if progress is not None:
+            progress(step, total_steps)
+
+    # Rules see shipping and discount lines too: Promo Code is detected from an order's discount lines
+    features = Features(df)
+    promo_type = classify(features, promos, progress=lambda i, n: advance(), profile=profile)
+    return finish_analysis(df, features, promo_type, advance, profile)
+
+
+def item_lines(features):
+    # Lines kept in the results: everything but shipping and order-level discount lines
+    return ~features.equals('Line: Type', 'Shipping Line') & ~features.equals('Line: Type', 'Discount')
+
+
+def finish_analysis(df, features, promo_type, advance=lambda: None, profile=NO_PROFILE):
+    # The steps after classification: drop shipping/discount lines, add Promo Type and
+    # Tier Group, and backfill Product Type. `advance` is called after each of the three.
+    with profile.stage("drop shipping/discount lines", rows_in=len(df)) as stage:
+        keep = item_lines(features)
+        df = df.take(np.flatnonzero(keep))  # a fresh frame, not a flagged slice of the input
+        df.insert(0, "Promo Type", promo_type[keep])
+        stage['rows_out'] = len(df)
+    advance()
+
+    with profile.stage("tier grouping", rows_in=len(df)):
+        df.insert(1, "Tier Group", features.tier_group()[keep])
+    advance()
+
+    # Fill in blank 'Line: Product Type' based on 'Line: Title'
+    with profile.stage("product type backfill", rows_in=len(df)) as stage:
+        product_type_blank = features.isnull('Line: Product Type')[keep]
+        trousers = product_type_blank & features.contains('Line: Title', 'Trouser')[keep]
+        waistcoats = product_type_blank & ~trousers & features.contains('Line: Title', 'Waistcoat')[keep]
+        product_type = df['Line: Product Type']
+        if isinstance(product_type.dtype, pd.CategoricalDtype):
+            new = [value for value in ['Trousers', 'Waistcoat'] if value not in product_type.cat.categories]
+            df['Line: Product Type'] = product_type.cat.add_categories(new)
+        df.loc[trousers, 'Line: Product Type'] = 'Trousers'
+        df.loc[waistcoats, 'Line: Product Type'] = 'Waistcoat'
+        stage['rows_tagged'] = np.count_nonzero(trousers) + np.count_nonzero(waistcoats)
+    advance()
+
+    return df
+
+
+def analyze_path(file_path, promos, progress=None, cache=None, profile=NO_PROFILE, store=None):
+    # With a promo_store.ResultStore, only orders it hasn't seen unchanged are classified
+    with profile.stage("read") as stage:
+        df = read_export(file_path, cache)
+        stage['rows_out'] = len(df)
+    analyze = store.analyze if store is not None else run_analysis
+    return analyze(df, promos, progress, profile=profile)
+
+
+def promo_totals(df):
+    return df.groupby('Promo Type', observed=True)[['Line: Total', 'Line: Quantity']].sum()
+
+
+def iter_analyzed_chunks(file_path, promos, chunksize=CHUNKSIZE, profile=NO_PROFILE, store=None):
+    # Classified chunks of a streamed export, one at a time. Chunks hold whole orders, so they
+    # can go through a promo_store.ResultStore too.
+    check_promos(promos)
+    analyze = store.analyze if store is not None else run_analysis
+    chunks = iter_export_chunks(file_path, chunksize)
+    while True:
+        with profile.stage("read") as stage:
+            chunk = next(chunks, None)
+            stage['rows_out'] = 0 if chunk is None else len(chunk)
+        if chunk is None:
+            return
+        yield analyze(normalize_export(chunk), promos, profile=profile)
+
+
+def analyze_path_chunked(file_path, promos, chunksize=CHUNKSIZE):
+    # Bounded-memory variant of analyze_path: classifies one chunk at a time and returns only
+    # the aggregate cube (see build_cube), ready for pivot_from_cube or chart_table. Exports
+    # whose orders aren't contiguous fall back to reading the whole sheet.
+    cube = None
+    try:
+        for chunk in iter_analyzed_chunks(file_path, promos, chunksize):
+            cube = merge_cubes(cube, build_cube(chunk))
+    except SplitOrderError:
+        return build_cube(analyze_path(file_path, promos))
+    return cube if cube is not None else empty_cube()
+
+
+def build_pivot_table(df, profile=NO_PROFILE):
+    with profile.stage("pivot", rows_in=len(df)) as stage:
+        pivot_table = pivot_from_totals(promo_totals(df))
+        stage['rows_out'] = len(pivot_table)
+    return pivot_table
+
+
+def pivot_from_cube(cube):
+    return pivot_from_totals(cube_totals(cube, 'Promo Type'))
+
+
+def pivot_from_totals(totals):
+    # Sales $ and quantity per promo, largest first, with a trailing 'Total' row
+    pivot_table = totals.sort_values('Line: Total', ascending=False)
+    pivot_table = pivot_table[pivot_table.index != '']  # Remove blank rows
+
+    # Reorder columns
+    pivot_table = pivot_table[['Line: Total', 'Line: Quantity']]
+
+    # Add total row
+    total_row = pd.DataFrame({
+        'Line: Total': pivot_table['Line: Total'].sum(),
+        'Line: Quantity': pivot_table['Line: Quantity'].sum()
+    }, index=['Total'])
+    return pd.concat([pivot_table, total_row])
+
+
+def order_dates(df):
+    # Calendar day of each line's order (NaT where missing); the local date, ignoring any UTC offset
+    if ORDER_DATE_COLUMN not in df:
+        return np.full(len(df), np.datetime64('NaT'), dtype='datetime64[ns]')
+    column = df[ORDER_DATE_COLUMN]
+    if pd.api.types.is_datetime64_any_dtype(column):
+        if column.dt.tz is not None:
+            column = column.dt.tz_localize(None)
+        return column.dt.normalize().to_numpy()
+    # Text like '2024-03-01 10:15:00 +1100': parse each distinct value once
+    codes, uniques = pd.factorize(column)
+    days = pd.to_datetime(pd.Index(uniques).astype(str).str[:10], format='%Y-%m-%d', errors='coerce')
+    return np.append(days.to_numpy(), np.datetime64('NaT'))[codes]  # code -1 (missing) -> NaT
+
+
+def build_cube(df):
+    # Sales $ and quantity of classified lines by CUBE_LEVELS. The cube's size depends on the
+    # number of promos, tiers, product types and days, not on the number of lines, so the
+    # chart, summary, pivot sheet and drill-downs are all cheap sums over it.
+    keys = [df['Promo Type'], df['Tier Group'], df['Line: Product Type'],
+            pd.Series(order_dates(df), index=df.index, name='Order Date')]
+    return df.groupby(keys, dropna=False, observed=True)[CUBE_VALUES].sum()
+
+
+def empty_cube():
+    index = pd.MultiIndex.from_arrays([[]] * len(CUBE_LEVELS), names=CUBE_LEVELS)
+    return pd.DataFrame({value: [] for value in CUBE_VALUES}, index=index)
+
+
+def merge_cubes(cube, other):
+    # Fold another chunk's cube into a running one
+    if cube is None:
+        return other
+    return pd.concat([cube, other]).groupby(level=CUBE_LEVELS, dropna=False, observed=True).sum()
+
+
+def cube_totals(cube, by='Promo Type', where=None):
+    # Totals per `by` (a cube level or list of levels), optionally only where levels have the
+    # given value or one of a list of values, e.g.
+    # cube_totals(cube, 'Tier Group', where={'Promo Type': 'TAF25'})
+    if where:
+        mask = np.ones(len(cube), dtype=bool)
+        for level, value in where.items():
+            values = cube.index.get_level_values(level)
+            mask &= values.isin(value) if isinstance(value, (list, set, tuple)) else values == value
+        cube = cube[mask]
+    return cube.groupby(level=by, dropna=False, observed=True)[CUBE_VALUES].sum()
+
+
+def chart_promo(promo):
+    # The GUI chart shows every multibuy as one 'Multibuy' slice
+    return 'Multibuy' if 'Multibuy' in promo else promo
+
+
+def chart_table(cube):
+    # Same breakdown as the pivot sheet, with the multibuys folded together
+    totals = cube_totals(cube, 'Promo Type')
+    totals = totals[totals.index != ''].groupby(chart_promo).sum()
+    return totals.sort_values(by='Line: Total', ascending=False)
+
+
+def chart_drill_down(cube, slice_name, by='Tier Group'):
+    # One chart slice split by another cube level, largest first
+    promos = cube.index.get_level_values('Promo Type').unique()
+    members = [promo for promo in promos if promo != '' and chart_promo(promo) == slice_name]
+    totals = cube_totals(cube, by, where={'Promo Type': members})
+    return totals.sort_values(by='Line: Total', ascending=False)
+
+
+def pie_slices(table):
+    # The rows a pie can show: those with positive sales. A promo made up of refunds or
+    # discounts nets out negative, and a pie has no wedge for that.
+    return table[table['Line: Total'] > 0]
+
+
+def sample_orders(df, max_orders=PREVIEW_ORDERS):
+    # Up to max_orders whole orders, so order-scoped rules (Promo Code, the multibuys) still see
+    # every line of a sampled order. Orders are picked by a hash of their ID: a simple random
+    # sample that keeps the same orders as more of an export is read. Returns the sample, the
+    # number of orders in it and the number of orders in df.
+    hashes = pd.util.hash_pandas_object(df['ID'], index=False).to_numpy()
+    order_hashes = np.unique(hashes)
+    if len(order_hashes) <= max_orders:
+        return df, len(order_hashes), len(order_hashes)
+    cutoff = np.partition(order_hashes, max_orders - 1)[max_orders - 1]
+    return df[hashes <= cutoff], max_orders, len(order_hashes)
+
+
+def preview_analysis(df, promos, partial=False, total_lines=None, max_orders=PREVIEW_ORDERS):
+    # Rough promo mix from a sample of df's orders: (cube, estimates, sampled orders). The cube
+    # is the sample's scaled up to the export, so it charts like build_cube's; estimates are the
+    # chart slices' sales shares with confidence intervals (see share_estimates). With `partial`,
+    # df is only the start of an export of total_lines lines (None when not known, in which case
+    # the cube covers the orders read so far).
+    sample, sampled, orders = sample_orders(df, max_orders)
+    total_orders = orders
+    if partial:
+        total_orders = max(orders, round(orders * total_lines / len(df))) if total_lines and len(df) else None
+    analyzed = run_analysis(sample, promos)
+    cube = build_cube(analyzed)
+    cube[CUBE_VALUES] *= (total_orders or orders) / max(sampled, 1)
+    return cube, share_estimates(analyzed, sampled, total_orders), sampled
+
+
+def share_estimates(df, sampled_orders, total_orders=None, z=CONFIDENCE_Z):
+    # Each chart slice's share of sales in classified lines from a simple random sample of
+    # orders: a ratio estimate per slice, with the variance of a cluster sample (orders are
+    # the clusters) and, when total_orders is known, the finite population correction.
+    # Largest share first.
+    df = df[df['Promo Type'] != '']
+    orders = OrderIndex(df['ID'])
+    slice_codes, slices = pd.factorize(df['Promo Type'].astype(str).map(chart_promo))
+    sales = np.nan_to_num(df['Line: Total'].to_numpy(dtype=float))
+
+    # Sales per order (x) and per order and slice (y)
+    x = np.bincount(orders.codes, weights=sales, minlength=orders.ngroups)
+    y = np.bincount(orders.codes * len(slices) + slice_codes, weights=sales,
+                    minlength=orders.ngroups * len(slices)).reshape(orders.ngroups, len(slices))
+    share = y.sum(axis=0) / x.sum() if x.sum() else np.zeros(len(slices))
+
+    n = sampled_orders
+    if n > 1 and x.sum():
+        # Orders with no classified lines have x = y = 0 and add nothing but their count
+        residuals = ((y - share * x[:, None]) ** 2).sum(axis=0) / (n - 1)
+        correction = 1 - n / total_orders if total_orders else 1
+        variance = correction * residuals / n / (x.sum() / n) ** 2
+        margin = z * np.sqrt(np.maximum(variance, 0))
+    else:
+        margin = np.zeros(len(slices))
+    estimates = pd.DataFrame({'Share': share, 'Share Low': np.clip(share - margin, 0, 1),
+                              'Share High': np.clip(share + margin, 0, 1)}, index=slices)
+    return estimates.sort_values('Share', ascending=False)
@@ -0,0 +1,242 @@
+"""Workbook export for classified promo data: raw sheet, formatted pivot sheet and pie chart.
+
+Workbooks are written with openpyxl's write-only worksheets, so rows go straight to disk as
+they are produced instead of being built up as cell objects first.
+"""
+import io
+
+import openpyxl
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.chart import BarChart, LineChart, PieChart, Reference
+from openpyxl.chart.label import DataLabelList
+from openpyxl.styles import Font
+from openpyxl.utils import get_column_letter
+
+from promo_engine import build_cube, empty_cube, merge_cubes, pie_slices, pivot_from_cube
+from promo_profile import NO_PROFILE
+
+EXCEL_MAX_ROWS = 1_048_576
+
+# What to do with the raw-data sheet when the lines don't fit on one Excel sheet
+OVERFLOW_ERROR = 'error'  # fail, like DataFrame.to_excel
+OVERFLOW_SPLIT = 'split'  # continue on 'Sheet1 (2)', 'Sheet1 (3)', ...
+OVERFLOW_SKIP = 'skip'  # leave the raw data out and write the pivot sheet only
+OVERFLOW_MODES = [OVERFLOW_ERROR, OVERFLOW_SPLIT, OVERFLOW_SKIP]
+
+WRITE_BATCH_ROWS = 10_000  # rows converted to Python values at a time
+
+# How the pivot sheet's pie chart is produced
+CHART_NATIVE = 'native'  # an Excel chart over the pivot cells; no rendering, no files
+CHART_IMAGE = 'image'  # a matplotlib PNG rendered in memory and embedded
+CHART_NONE = 'none'
+CHART_MODES = [CHART_NATIVE, CHART_IMAGE, CHART_NONE]
+
+
+def save_workbook(df, file_path, overflow=OVERFLOW_ERROR, chart=CHART_NATIVE, profile=NO_PROFILE, cube=None,
+                  progress=None):
+    # `progress(rows_written, total_rows)`, when given, follows every batch of raw rows
+    # Known up front to be too long: don't stream a million rows only to fail or drop them
+    too_long = len(df) > EXCEL_MAX_ROWS - 1
+    if too_long and overflow == OVERFLOW_ERROR:
+        raise ValueError(RawSheetWriter.too_long_message)
+    include_raw = not (too_long and overflow == OVERFLOW_SKIP)
+    on_rows = (lambda rows_written: progress(rows_written, len(df))) if progress is not None else None
+    write_workbook([df], file_path, overflow, include_raw, chart, profile, cube, on_rows)
+
+
+def write_workbook(chunks, file_path, overflow=OVERFLOW_ERROR, include_raw=True, chart=CHART_NATIVE,
+                   profile=NO_PROFILE, cube=None, progress=None):
+    # `chunks` is any iterable of classified frames (one frame, or a streaming run's chunks);
+    # each is written and folded into the aggregate cube before the next one is produced.
+    # Pass the cube when it has already been built to skip that. `progress(rows_written)`
+    # follows every batch of raw rows.
+    if overflow not in OVERFLOW_MODES:
+        raise ValueError(f"Unknown overflow mode: {overflow}")
+    if chart not in CHART_MODES:
+        raise ValueError(f"Unknown chart mode: {chart}")
+
+    workbook = openpyxl.Workbook(write_only=True)
+    raw = RawSheetWriter(workbook, overflow, progress)
+    precomputed = cube is not None
+    try:
+        for chunk in chunks:
+            if include_raw:
+                with profile.stage("write raw sheet", rows_in=len(chunk)):
+                    raw.write(chunk)
+            if not precomputed:
+                with profile.stage("aggregate cube", rows_in=len(chunk)):
+                    cube = merge_cubes(cube, build_cube(chunk))
+    except Exception:
+        raw.drop_raw_sheets()  # release the sheets' temp files; nothing is saved
+        raise
+    if cube is None:
+        cube = empty_cube()
+
+    with profile.stage("write pivot sheet"):
+        write_pivot_sheet(workbook, pivot_from_cube(cube), chart)
+    with profile.stage("save workbook"):
+        workbook.save(file_path)
+
+
+class RawSheetWriter:
+    """Streams classified rows onto 'Sheet1', starting a new sheet when one fills up."""
+
+    too_long_message = f"More than {EXCEL_MAX_ROWS - 1:,} lines don't fit on one sheet; split or skip the raw data"
+
+    def __init__(self, workbook, overflow, progress=None):
+        self.workbook = workbook
+        self.overflow = overflow
+        self.progress = progress
+        self.rows_written = 0
+        self.sheets = 0
+        self.worksheet = None
+        self.rows_on_sheet = 0
+        self.skipped = False
+
+    def new_sheet(self, columns):
+        self.sheets += 1
+        title = 'Sheet1' if self.sheets == 1 else f'Sheet1 ({self.sheets})'
+        self.worksheet = self.workbook.create_sheet(title)
+        self.worksheet.append([styled_cell(self.worksheet, name, bold=True) for name in columns])
+        self.rows_on_sheet = 0
+
+    def write(self, df):
+        if self.skipped:
+            return
+        if self.worksheet is None:
+            self.new_sheet(df.columns)
+
+        for start in range(0, len(df), WRITE_BATCH_ROWS):
+            batch = df.iloc[start:start + WRITE_BATCH_ROWS]
+            # Blank cells must be written as None, not NaN/NaT
+            batch = batch.astype(object).where(batch.notna(), None)
+            for row in batch.itertuples(index=False, name=None):
+                if self.rows_on_sheet == EXCEL_MAX_ROWS - 1:
+                    if self.overflow == OVERFLOW_SPLIT:
+                        self.new_sheet(df.columns)
+                    elif self.overflow == OVERFLOW_SKIP:
+                        self.drop_raw_sheets()
+                        return
+                    else:
+                        raise ValueError(self.too_long_message)
+                self.worksheet.append(row)
+                self.rows_on_sheet += 1
+            self.rows_written += len(batch)
+            if self.progress is not None:
+                self.progress(self.rows_written)
+
+    def drop_raw_sheets(self):
+        # Write-only sheets can't be truncated, but they can be left out of the workbook
+        for worksheet in list(self.workbook.worksheets):
+            worksheet.close()
+            self.workbook.remove(worksheet)
+        self.skipped = True
+
+
+def styled_cell(worksheet, value, bold=False, number_format=None):
+    # A write-only cell carrying its own font and number format
+    cell = WriteOnlyCell(worksheet, value=value)
+    if bold:
+        cell.font = Font(bold=True)
+    if number_format:
+        cell.number_format = number_format
+    return cell
+
+
+def write_pivot_sheet(workbook, pivot_table, chart=CHART_NATIVE):
+    worksheet = workbook.create_sheet('Promo Analysis')
+
+    # Formatting
+    for col in ['A', 'B', 'C']:
+        worksheet.column_dimensions[col].width = 20
+
+    # Header row, then one row per promo with Sales $ formatted as currency
+    worksheet.append([styled_cell(worksheet, 'Promo Type', bold=True),
+                      styled_cell(worksheet, 'Sales $', bold=True, number_format='$#,##0'),
+                      styled_cell(worksheet, 'Quantity', bold=True)])
+    rows = zip(pivot_table.index, pivot_table['Line: Total'].tolist(), pivot_table['Line: Quantity'].tolist())
+    for promo, total, quantity in rows:
+        worksheet.append([styled_cell(worksheet, promo, bold=True),
+                          styled_cell(worksheet, total, number_format='$#,##0'),
+                          styled_cell(worksheet, quantity)])
+
+    promo_rows = len(pivot_table) - 1  # Exclude 'Total' from the chart
+    if chart == CHART_NATIVE and promo_rows > 0:
+        worksheet.add_chart(native_pie_chart(worksheet, promo_rows), 'E2')
+    elif chart == CHART_IMAGE:
+        slices = pie_slices(pivot_table.iloc[:-1])  # a net-negative promo has no wedge
+        if len(slices):
+            worksheet.add_image(pie_chart_image(slices), 'E2')
+
+
+def native_pie_chart(worksheet, promo_rows):
+    # Pie over the pivot sheet's own cells: Excel draws it, so cost doesn't depend on the data
+    pie = PieChart()
+    pie.title = "Promo Analysis by Sales $"
+    pie.width, pie.height = 20, 15  # cm, about the size of the old 8x6in image
+    data = Reference(worksheet, min_col=2, min_row=1, max_row=promo_rows + 1)
+    labels = Reference(worksheet, min_col=1, min_row=2, max_row=promo_rows + 1)
+    pie.add_data(data, titles_from_data=True)
+    pie.set_categories(labels)
+    pie.dataLabels = DataLabelList()
+    pie.dataLabels.showPercent = True
+    return pie
+
+
+def pie_chart_image(pivot_table):
+    # matplotlib is only needed for this mode; a bare Figure keeps pyplot state out of workers
+    from matplotlib.figure import Figure
+
+    fig = Figure(figsize=(8, 6))
+    ax = fig.subplots()
+    ax.pie(pivot_table['Line: Total'].to_numpy(), labels=pivot_table.index.to_numpy(),
+           autopct='%1.0f%%', pctdistance=0.85)
+    ax.set_title("Promo Analysis by Sales $")
+
+    # Customize the chart appearance
+    ax.legend(bbox_to_anchor=(1.05, 1), loc='upper left')  # Move legend outside the chart
+    ax.axis('equal')
+
+    # Rendered into memory, so concurrent saves never share a file on disk
+    buffer = io.BytesIO()
+    fig.savefig(buffer, format='png', bbox_inches='tight')
+    buffer.seek(0)
+    return openpyxl.drawing.image.Image(buffer)
+
+
+def write_comparison_workbook(sales, quantity, file_path):
+    # Period x promo time series (see promo_compare): `sales` and `quantity` have one row per
+    # period and one column per promo. Each sheet gets a native chart over its own cells.
+    period_sales = sales.sum(axis=1)
+    share = sales.div(period_sales.where(period_sales != 0), axis=0).fillna(0)
+
+    workbook = openpyxl.Workbook(write_only=True)
+    write_period_sheet(workbook, 'Sales $', sales, '$#,##0', LineChart())
+    write_period_sheet(workbook, 'Sales Share', share, '0%', BarChart())
+    write_period_sheet(workbook, 'Quantity', quantity, '#,##0', None)
+    workbook.save(file_path)
+
+
+def write_period_sheet(workbook, title, table, number_format, chart):
+    worksheet = workbook.create_sheet(title)
+    worksheet.column_dimensions['A'].width = 24
+    for i in range(len(table.columns)):
+        worksheet.column_dimensions[get_column_letter(i + 2)].width = 16
+
+    worksheet.append([styled_cell(worksheet, 'Period', bold=True)] +
+                     [styled_cell(worksheet, promo, bold=True) for promo in table.columns])
+    for period, values in zip(table.index, table.itertuples(index=False, name=None)):
+        worksheet.append([styled_cell(worksheet, period, bold=True)] +
+                         [styled_cell(worksheet, value, number_format=number_format) for value in values])
+
+    if chart is None or table.empty:
+        return
+    chart.title = f"{title} by Promo Type"
+    chart.width, chart.height = 30, 15
+    if isinstance(chart, BarChart):
+        # Each period's bar split into its promos' shares: cannibalization shows as bands trading places
+        chart.type, chart.grouping, chart.overlap = 'col', 'percentStacked', 100
+    data = Reference(worksheet, min_col=2, max_col=len(table.columns) + 1, min_row=1, max_row=len(table) + 1)
+    chart.add_data(data, titles_from_data=True)
+    chart.set_categories(Reference(worksheet, min_col=1, min_row=2, max_row=len(table) + 1))
+    worksheet.add_chart(chart, f"{get_column_letter(len(table.columns) + 3)}2")
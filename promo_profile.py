@@ -0,0 +1,132 @@
+"""Per-stage instrumentation for analysis runs: timings, memory and row counts as a JSON report.
+
+Stages are recorded with `profile.stage(name)`; the record it yields takes the stage's row
+counts (rows_in, rows_out, rows_tagged, ...). A stage entered more than once, e.g. once per
+chunk of a streamed export, adds up into a single entry. Code that isn't being profiled gets
+NO_PROFILE, whose stages cost nothing.
+"""
+import cProfile
+import json
+import os
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+# Row counts a stage may report; anything left unset is omitted from the report
+ROW_COUNTS = ['rows_in', 'rows_out', 'rows_matched', 'rows_tagged', 'rows_overridden']
+
+# Added to reports recorded with memory tracking on
+MEMORY_TRACED_NOTE = ("tracemalloc was on: every allocation is traced, so timings are inflated "
+                      "(parsing several times slower); profile without memory tracking for timings")
+
+
+class RunProfile:
+    """Collects stage records for one run; use as a context manager around the whole run.
+
+    It can be entered again later, e.g. for an export requested after the analysis finished;
+    the stages and wall time then add up.
+    """
+
+    def __init__(self, label=None, track_memory=True, cprofile=False):
+        self.label = label
+        self.track_memory = track_memory
+        self.profiler = cProfile.Profile() if cprofile else None
+        self.stages = {}  # name -> record, in the order stages first ran
+        self.wall_seconds = 0.0
+        self._started = None
+        self._started_tracing = False
+
+    def __enter__(self):
+        if self.track_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracing = True
+        if self.profiler is not None:
+            self.profiler.enable()
+        self._started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.wall_seconds += time.perf_counter() - self._started
+        if self.profiler is not None:
+            self.profiler.disable()
+        if self._started_tracing:
+            tracemalloc.stop()
+            self._started_tracing = False
+        return False
+
+    @contextmanager
+    def stage(self, name, rows_in=None):
+        counts = {'rows_in': rows_in}
+        tracing = tracemalloc.is_tracing()
+        if tracing:
+            memory_before = tracemalloc.get_traced_memory()[0]
+            if hasattr(tracemalloc, 'reset_peak'):  # Python 3.9+
+                tracemalloc.reset_peak()
+        wall, cpu = time.perf_counter(), time.process_time()
+        yield counts
+
+        wall, cpu = time.perf_counter() - wall, time.process_time() - cpu
+        peak_delta = tracemalloc.get_traced_memory()[1] - memory_before if tracing else None
+        record = self.stages.setdefault(name, {'calls': 0, 'wall_seconds': 0.0, 'cpu_seconds': 0.0,
+                                               'peak_memory_delta_mb': None})
+        record['calls'] += 1
+        record['wall_seconds'] += wall
+        record['cpu_seconds'] += cpu
+        if peak_delta is not None:
+            record['peak_memory_delta_mb'] = max(record['peak_memory_delta_mb'] or 0.0, peak_delta / 1024 ** 2)
+        for key in ROW_COUNTS:
+            if counts.get(key) is not None:
+                record[key] = record.get(key, 0) + int(counts[key])
+
+    def report(self):
+        stages = []
+        for name, record in self.stages.items():
+            entry = {'stage': name}
+            entry.update(record)
+            entry['wall_seconds'] = round(entry['wall_seconds'], 4)
+            entry['cpu_seconds'] = round(entry['cpu_seconds'], 4)
+            if entry['peak_memory_delta_mb'] is not None:
+                entry['peak_memory_delta_mb'] = round(entry['peak_memory_delta_mb'], 2)
+            stages.append(entry)
+        report = {
+            'label': self.label,
+            'wall_seconds': round(self.wall_seconds, 4),
+            'memory_traced': self.track_memory,
+        }
+        if self.track_memory:
+            report['note'] = MEMORY_TRACED_NOTE
+        report['stages'] = stages
+        return report
+
+    def write_json(self, file_path):
+        with open(file_path, 'w') as f:
+            json.dump(self.report(), f, indent=2)
+
+    def dump_cprofile(self, file_path):
+        # Readable with `python -m pstats` or snakeviz
+        if self.profiler is not None:
+            self.profiler.dump_stats(file_path)
+
+    def save(self, output_dir, stem):
+        # <stem>_profile.json, plus <stem>.prof when cProfile was on; returns the JSON path
+        os.makedirs(output_dir, exist_ok=True)
+        json_path = os.path.join(output_dir, f"{stem}_profile.json")
+        self.write_json(json_path)
+        if self.profiler is not None:
+            self.dump_cprofile(os.path.join(output_dir, f"{stem}.prof"))
+        return json_path
+
+
+class _NoProfile:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+    @contextmanager
+    def stage(self, name, rows_in=None):
+        yield {}
+
+
+NO_PROFILE = _NoProfile()
@@ -0,0 +1,224 @@
+"""Declarative promo rules, compiled to vectorized masks over a dataset's promo_engine.Features.
+
+A rule is built from predicates on line columns (tags, titles, product types, discount-ratio
+bands, money sets) and order-level conditions, combined with &, | and ~:
+
+    "Chino Multibuy": multibuy(tags("discount:2_each_$110") & money_multiple_of(TOTAL, 110)),
+
+Calling a rule with a dataset's Features returns a boolean mask of its lines. Every node is
+evaluated at most once per dataset: predicates are memoized by Features, and composite nodes by
+their canonical key (operands of & and | are flattened and sorted), so sub-expressions shared
+across promos, like the 25%-off band or compare-at-zero, are only computed once.
+"""
+import hashlib
+import re
+from functools import reduce
+
+from promo_catalog import PROMO_PRIORITY
+
+# Columns the rules read
+TAGS = 'Line: Product Tags'
+TITLE = 'Line: Title'
+PRODUCT_TYPE = 'Line: Product Type'
+LINE_TYPE = 'Line: Type'
+LINE_NAME = 'Line: Name'
+TOTAL = 'Line: Total'
+DISCOUNT = 'Line: Discount'
+DISCOUNT_PER_ITEM = 'Line: Discount per Item'
+COMPARE_AT = 'Line: Variant Compare At Price'
+
+# Bump when what the rule nodes or the Features predicates compute changes. Edits to the
+# declarations in PROMO_RULES don't need a bump: they change RULES_FINGERPRINT on their own.
+RULES_VERSION = 2
+
+# A multibuy only applies when the order holds at least this many qualifying units
+MULTIBUY_MIN_ITEMS = 2
+
+
+class Rule:
+    """A predicate over a dataset's lines; rule(features) is its boolean mask."""
+
+    def __init__(self, key):
+        self.key = key  # hashable and canonical: equal rules have equal keys
+
+    def __call__(self, f):
+        return f.memo(('rule',) + self.key, lambda: self.evaluate(f))
+
+    def evaluate(self, f):
+        raise NotImplementedError
+
+    def __and__(self, other):
+        return Composite('all', self, other)
+
+    def __or__(self, other):
+        return Composite('any', self, other)
+
+    def __invert__(self):
+        return Not(self)
+
+    def __repr__(self):
+        return f"{type(self).__name__}{self.key!r}"
+
+
+class Predicate(Rule):
+    # A memoized Features method, e.g. Predicate('contains', TITLE, 'Mattia')
+    def __init__(self, method, *args):
+        super().__init__((method,) + args)
+
+    def __call__(self, f):
+        return getattr(f, self.key[0])(*self.key[1:])
+
+
+class Composite(Rule):
+    def __init__(self, op, *rules):
+        operands = {}
+        for rule in rules:
+            for operand in (rule.operands if isinstance(rule, Composite) and rule.op == op else [rule]):
+                operands[operand.key] = operand
+        self.op = op
+        self.operands = [operands[key] for key in sorted(operands, key=repr)]
+        super().__init__((op,) + tuple(operand.key for operand in self.operands))
+
+    def evaluate(self, f):
+        masks = [operand(f) for operand in self.operands]
+        return reduce(lambda a, b: a & b, masks) if self.op == 'all' else reduce(lambda a, b: a | b, masks)
+
+
+class Not(Rule):
+    def __init__(self, rule):
+        self.rule = rule
+        super().__init__(('not', rule.key))
+
+    def evaluate(self, f):
+        return ~self.rule(f)
+
+
+class OrderAny(Rule):
+    def __init__(self, rule):
+        self.rule = rule
+        super().__init__(('order_any', rule.key))
+
+    def evaluate(self, f):
+        return f.orders().any(self.rule(f))
+
+
+class Multibuy(Rule):
+    def __init__(self, rule, min_items):
+        self.rule = rule
+        self.min_items = min_items
+        super().__init__(('multibuy', rule.key, min_items))
+
+    def evaluate(self, f):
+        mask = self.rule(f)
+        return mask & (f.order_quantity(mask) >= self.min_items)
+
+
+# The rule vocabulary
+
+def tags(*names):
+    # Lines tagged with any of these product tags, as whole words
+    alternatives = '|'.join(re.escape(name) for name in names)
+    return Predicate('contains', TAGS, rf'\b{alternatives}\b' if len(names) == 1 else rf'\b(?:{alternatives})\b')
+
+
+def title(pattern):
+    return Predicate('contains', TITLE, pattern)
+
+
+def title_is(value):
+    return Predicate('equals', TITLE, value)
+
+
+def product_type(pattern):
+    return Predicate('contains', PRODUCT_TYPE, pattern)
+
+
+def line_type(value):
+    return Predicate('equals', LINE_TYPE, value)
+
+
+def line_name_in(*names):
+    return Predicate('isin', LINE_NAME, names)
+
+
+def discount_ratio(low, high):
+    # Discount per item over price, rounded to cents of a dollar, within [low, high]
+    return Predicate('ratio_between', low, high)
+
+
+def money_in(column, *amounts):
+    return Predicate('money_is', column, *amounts)
+
+
+def money_multiple_of(column, amount):
+    return Predicate('money_multiple_of', column, amount)
+
+
+def money_above(column, amount):
+    return Predicate('money_above', column, amount)
+
+
+def money_nonzero(column):
+    # Filled in and not zero
+    return Predicate('money_nonzero', column)
+
+
+def order_any(rule):
+    # Every line of an order where any line matches `rule`
+    return OrderAny(rule)
+
+
+def multibuy(rule, min_items=MULTIBUY_MIN_ITEMS):
+    # Lines matching `rule` whose order holds at least min_items units matching it
+    return Multibuy(rule, min_items)
+
+
+# Campaigns
+
+SUIT_MULTIBUY_PRICES = [175, 200, 275, 350, 400, 425, 575, 700]
+SUBLIME_SUIT_DISCOUNTS = [-174.50, -199.50, -249.50]
+
+COMPARE_AT_ZERO = money_in(COMPARE_AT, 0)
+QUARTER_OFF = discount_ratio(0.24, 0.26)
+
+PROMO_RULES = {
+    "$399 & $599 Suits": tags("automatic:$399 Suits", "automatic:$599 Suits") &
+                         money_in(DISCOUNT_PER_ITEM, *SUBLIME_SUIT_DISCOUNTS),
+    "25% Off Chinos": QUARTER_OFF & product_type('Chino') & COMPARE_AT_ZERO,
+    "25% Off Coats/Outerwear": QUARTER_OFF & product_type('Outerwear') & COMPARE_AT_ZERO,
+    "25% Off Selected Styles": QUARTER_OFF & COMPARE_AT_ZERO,
+    "25% Off Tailoring": QUARTER_OFF & tags('25OFFWINTERTAILORING') & COMPARE_AT_ZERO,
+    "40% Off Tailoring": discount_ratio(0.39, 0.41) & tags('40_Off_Tailoring_May24') & COMPARE_AT_ZERO,
+    "50% Off 50 Styles": tags('5050Jul24'),
+    "Casual Bottom Multibuy": discount_ratio(0.29, 0.31) & product_type('Chino') & COMPARE_AT_ZERO,
+    "Chino Multibuy": multibuy(tags('discount:2_each_$110') & money_multiple_of(TOTAL, 110)),
+    "FP Purchase": COMPARE_AT_ZERO & money_in(DISCOUNT, 0) & money_in(DISCOUNT_PER_ITEM, 0),
+    "Gift Card": title_is('Gift Card'),
+    "Knits Offer": QUARTER_OFF & product_type('Knitwear') & COMPARE_AT_ZERO,
+    "Linen Shirts Multibuy": multibuy(tags('discount:2_each_$130') & money_multiple_of(TOTAL, 130)),
+    "MD Purchase": line_type('Line Item') & money_nonzero(COMPARE_AT),
+    "Polo Multibuy": multibuy(tags('discount:2_each_$109') & money_multiple_of(TOTAL, 109.99)),
+    # Every line of an order that used a UNIDAYS code
+    "Promo Code": order_any(line_name_in('UNIDAYS', 'UNIDAYS20') & ~line_type('Line Item')),
+    "Shirts Multibuy": product_type('Shirts') & money_in(DISCOUNT_PER_ITEM, -30),
+    "Suit Multibuy": multibuy(title('Jacket|Trouser') & money_in(TOTAL, *SUIT_MULTIBUY_PRICES)),
+    "TAF25": QUARTER_OFF & money_above(COMPARE_AT, 0),
+    "Tee Multibuy": multibuy(title('Mattia') & money_multiple_of(TOTAL, 40) & money_nonzero(TOTAL)),
+}
+
+# A campaign needs both a rule here and a place in promo_catalog.PROMO_PRIORITY; a rule missing
+# from the priority list would be accepted by check_promos and then never applied
+if set(PROMO_RULES) != set(PROMO_PRIORITY):
+    raise ValueError(f"PROMO_RULES and PROMO_PRIORITY disagree: "
+                     f"no priority for {sorted(set(PROMO_RULES) - set(PROMO_PRIORITY))}, "
+                     f"no rule for {sorted(set(PROMO_PRIORITY) - set(PROMO_RULES))}")
+
+
+def rules_fingerprint(rules=PROMO_RULES, priority=PROMO_PRIORITY):
+    # Hash of the evaluator version, the priority order and every rule's canonical definition;
+    # results stored or cached under it go stale whenever any of them changes
+    definitions = [(promo, rules[promo].key) for promo in priority]
+    return hashlib.sha256(repr((RULES_VERSION, definitions)).encode()).hexdigest()
+
+
+RULES_FINGERPRINT = rules_fingerprint()
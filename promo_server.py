@@ -0,0 +1,467 @@
+"""Local HTTP service around the promo pipeline: upload an export, poll the job, download the results.
+
+Jobs run on a bounded process pool. Once every worker is busy and the queue is full, new
+uploads get 503 with Retry-After instead of piling up. Finished results are kept by the
+export's SHA-256 plus the promo rules applied, so a repeat request is answered from disk
+without running anything. Standard library only, so it runs wherever the pipeline does.
+
+Endpoints:
+    GET  /promos                  known promo names
+    POST /jobs?promo=NAME&...     body: the .xlsx export (or ?all_promos=1); 202 with the job
+    GET  /jobs/<id>               status (queued/running/done/failed), progress 0-1, message
+    GET  /jobs/<id>/workbook      classified workbook: raw lines plus the pivot sheet
+    GET  /jobs/<id>/pivot         the pivot as JSON
+
+Example:
+    python promo_server.py --port 8000 --workers 2
+    curl --data-binary @export.xlsx "http://localhost:8000/jobs?promo=Chino+Multibuy&promo=TAF25"
+    curl http://localhost:8000/jobs/<id>
+    curl -o analysed.xlsx http://localhost:8000/jobs/<id>/workbook
+"""
+import argparse
+import hashlib
+import json
+import multiprocessing
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+from promo_cache import CACHE_DIR, ExportCache
+from promo_catalog import DEFAULT_PROMOS
+from promo_engine import PROMO_RULES, check_promos, ranked_promos
+from promo_rules import RULES_FINGERPRINT
+
+RESULTS_DIR = os.environ.get('PROMO_RESULTS_DIR') or os.path.join(CACHE_DIR, 'results')
+MAX_RESULTS_BYTES = 2 * 1024 ** 3  # finished results kept on disk, least recently used dropped first
+MAX_UPLOAD_BYTES = 512 * 1024 ** 2
+QUEUE_SIZE = 8  # jobs waiting for a free worker before uploads are turned away
+RETRY_AFTER_S = 30
+JOB_HISTORY = 1000  # finished jobs remembered for polling
+UPLOAD_BLOCK = 1024 * 1024
+
+# Progress shares of a job's stages; writing the workbook takes the rest
+READ_SHARE = 0.5
+CLASSIFY_SHARE = 0.1
+
+WORKBOOK_NAME = 'analysed.xlsx'
+PIVOT_NAME = 'pivot.json'
+SUMMARY_NAME = 'summary.json'
+XLSX_TYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'
+
+QUEUED, RUNNING, DONE, FAILED = 'queued', 'running', 'done', 'failed'
+
+
+# Worker process side
+
+_progress = None  # queue back to the service's progress listener, set per worker process
+
+
+def _init_worker(progress):
+    global _progress
+    _progress = progress
+
+
+def run_job(job_id, source_path, promos, result_dir, cache_dir=None):
+    # Runs in a worker process: classify the export and write the workbook, pivot and summary
+    # into result_dir. They are written next to it and renamed into place, so a result
+    # directory is always complete.
+    from promo_engine import build_cube, load_cached, pivot_from_cube, read_export_streamed, run_analysis
+    from promo_export import OVERFLOW_SPLIT, save_workbook
+
+    started = time.perf_counter()
+
+    def report(fraction, text):
+        if _progress is not None:
+            _progress.put((job_id, fraction, text))
+
+    def on_rows(rows_read, total_rows):
+        fraction = READ_SHARE * min(rows_read / total_rows, 1) if total_rows else 0
+        report(fraction, f"Parsed {rows_read:,} rows")
+
+    def on_step(step, total_steps):
+        report(READ_SHARE + CLASSIFY_SHARE * step / total_steps, f"Applied {step} of {total_steps} analysis steps")
+
+    def read(path):
+        return read_export_streamed(path, on_rows)
+
+    report(0, "Reading export")
+    df = load_cached(ExportCache(cache_dir), source_path, read) if cache_dir else read(source_path)
+    df = run_analysis(df, promos, progress=on_step)
+    cube = build_cube(df)
+
+    report(READ_SHARE + CLASSIFY_SHARE, f"Writing workbook of {len(df):,} lines")
+    staging = tempfile.mkdtemp(dir=os.path.dirname(result_dir), prefix='.staging-')
+    try:
+        save_workbook(df, os.path.join(staging, WORKBOOK_NAME), OVERFLOW_SPLIT, cube=cube)
+        pivot = pivot_from_cube(cube)
+        with open(os.path.join(staging, PIVOT_NAME), 'w') as f:
+            json.dump([{'promo': promo, 'sales': float(row['Line: Total']), 'quantity': float(row['Line: Quantity'])}
+                       for promo, row in pivot.iterrows()], f, indent=2)
+        summary = {'lines': len(df), 'promos': list(promos), 'seconds': round(time.perf_counter() - started, 3)}
+        with open(os.path.join(staging, SUMMARY_NAME), 'w') as f:
+            json.dump(summary, f, indent=2)
+        try:
+            os.rename(staging, result_dir)
+        except OSError:
+            if not os.path.isdir(result_dir):
+                raise
+            shutil.rmtree(staging)  # an identical job finished first; its result is the same
+    except BaseException:
+        shutil.rmtree(staging, ignore_errors=True)
+        raise
+    return summary
+
+
+# Service side
+
+class Job:
+    def __init__(self, key, digest, promos):
+        self.job_id = uuid.uuid4().hex
+        self.key = key
+        self.digest = digest
+        self.promos = promos
+        self.status = QUEUED
+        self.progress = 0.0
+        self.message = "Waiting for a worker"
+        self.error = None
+        self.summary = None
+        self.cached = False
+        self.created = time.time()
+        self.finished = None
+
+    def to_json(self):
+        result = {
+            'job_id': self.job_id,
+            'status': self.status,
+            'progress': round(self.progress, 3),
+            'message': self.message,
+            'promos': self.promos,
+            'cached': self.cached,
+        }
+        if self.error:
+            result['error'] = self.error
+        if self.summary:
+            result['lines'] = self.summary.get('lines')
+        if self.status == DONE:
+            result['workbook'] = f"/jobs/{self.job_id}/workbook"
+            result['pivot'] = f"/jobs/{self.job_id}/pivot"
+        return result
+
+
+class JobService:
+    """Job bookkeeping, the worker pool and the result cache; shared by the request threads."""
+
+    def __init__(self, results_dir=RESULTS_DIR, workers=None, queue_size=QUEUE_SIZE, cache_dir=CACHE_DIR,
+                 max_results_bytes=MAX_RESULTS_BYTES):
+        self.results_dir = results_dir
+        self.uploads_dir = os.path.join(results_dir, 'uploads')
+        os.makedirs(self.uploads_dir, exist_ok=True)
+        self.cache_dir = cache_dir
+        self.max_results_bytes = max_results_bytes
+        self.workers = workers or os.cpu_count() or 1
+        self.capacity = self.workers + queue_size  # running plus waiting
+
+        self.lock = threading.Lock()
+        self.jobs = {}  # job_id -> Job
+        self.active = {}  # result key -> Job, for queued and running jobs
+        self.progress = multiprocessing.Queue()
+        self.pool = ProcessPoolExecutor(self.workers, initializer=_init_worker, initargs=(self.progress,))
+        self.listener = threading.Thread(target=self._drain_progress, daemon=True)
+        self.listener.start()
+
+    def result_key(self, digest, promos):
+        # Selections that apply the same rules (see ranked_promos) share one result; editing
+        # any rule definition changes RULES_FINGERPRINT and so every key
+        selection = '\n'.join(ranked_promos(promos))
+        return hashlib.sha256(f"{RULES_FINGERPRINT}\n{digest}\n{selection}".encode()).hexdigest()
+
+    def result_path(self, key, name=None):
+        path = os.path.join(self.results_dir, key)
+        return os.path.join(path, name) if name else path
+
+    def upload_path(self, digest):
+        return os.path.join(self.uploads_dir, f"{digest}.xlsx")
+
+    def get(self, job_id):
+        with self.lock:
+            return self.jobs.get(job_id)
+
+    def submit(self, upload, digest, promos):
+        # Takes over the uploaded file at `upload`. Returns the job (an identical one already
+        # queued or running, or one answered from the result cache), or None at capacity.
+        key = self.result_key(digest, promos)
+        with self.lock:
+            if key in self.active:
+                os.remove(upload)
+                return self.active[key]
+
+            job = Job(key, digest, list(promos))
+            if os.path.isdir(self.result_path(key)):
+                os.remove(upload)
+                os.utime(self.result_path(key))  # recently used, see evict
+                job.status, job.progress, job.message, job.cached = DONE, 1.0, "Served from the result cache", True
+                job.summary = self._read_summary(key)
+                job.finished = time.time()
+                self._remember(job)
+                return job
+
+            if len(self.active) >= self.capacity:
+                os.remove(upload)
+                return None
+
+            # Named by content: a parse cached by an earlier upload of the same export is reused
+            os.replace(upload, self.upload_path(digest))
+            try:
+                future = self.pool.submit(run_job, job.job_id, self.upload_path(digest), job.promos,
+                                          self.result_path(key), self.cache_dir)
+            except Exception:
+                # e.g. a broken pool: the job never ran, so it mustn't hold a slot
+                self._remove_upload(digest)
+                raise
+            self._remember(job)
+            self.active[key] = job
+        future.add_done_callback(lambda future: self._finished(job, future))
+        return job
+
+    def _remove_upload(self, digest):
+        # Called with the lock held; the file stays while another active job still reads it
+        if any(other.digest == digest for other in self.active.values()):
+            return
+        try:
+            os.remove(self.upload_path(digest))
+        except FileNotFoundError:
+            pass
+
+    def _read_summary(self, key):
+        try:
+            with open(self.result_path(key, SUMMARY_NAME)) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _remember(self, job):
+        # Called with the lock held; forgets the oldest finished jobs beyond JOB_HISTORY
+        self.jobs[job.job_id] = job
+        if len(self.jobs) > JOB_HISTORY + self.capacity:
+            finished = sorted((j for j in self.jobs.values() if j.finished), key=lambda j: j.finished)
+            for old in finished[:len(self.jobs) - JOB_HISTORY - self.capacity]:
+                del self.jobs[old.job_id]
+
+    def _finished(self, job, future):
+        with self.lock:
+            del self.active[job.key]
+            job.finished = time.time()
+            try:
+                job.summary = future.result()
+            except Exception as e:
+                job.status, job.error, job.message = FAILED, str(e) or type(e).__name__, "Analysis failed"
+            else:
+                job.status, job.progress, job.message = DONE, 1.0, f"Analysed {job.summary['lines']:,} lines"
+            self._remove_upload(job.digest)
+        self.evict()
+
+    def _drain_progress(self):
+        while True:
+            message = self.progress.get()
+            if message is None:
+                return
+            job_id, fraction, text = message
+            with self.lock:
+                job = self.jobs.get(job_id)
+                if job is not None and job.status in (QUEUED, RUNNING):
+                    job.status, job.progress, job.message = RUNNING, fraction, text
+
+    def evict(self):
+        # Drop the least recently used results beyond max_results_bytes
+        entries = []
+        for name in os.listdir(self.results_dir):
+            path = os.path.join(self.results_dir, name)
+            if name == 'uploads' or name.startswith('.') or not os.path.isdir(path):
+                continue
+            try:
+                size = sum(os.path.getsize(os.path.join(path, f)) for f in os.listdir(path))
+                entries.append((os.stat(path).st_mtime, size, path))
+            except FileNotFoundError:
+                continue
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_results_bytes:
+                break
+            shutil.rmtree(path, ignore_errors=True)
+            total -= size
+
+    def close(self):
+        self.pool.shutdown(wait=False, cancel_futures=True)
+        self.progress.put(None)
+
+
+class RequestHandler(BaseHTTPRequestHandler):
+    server_version = "PromoAnalysis/1.0"
+
+    @property
+    def service(self):
+        return self.server.service
+
+    def do_GET(self):
+        parts = urlsplit(self.path).path.strip('/').split('/')
+        if parts == ['promos']:
+            return self.send_json(200, list(PROMO_RULES))
+        if len(parts) not in (2, 3) or parts[0] != 'jobs':
+            return self.send_json(404, {'error': "not found"})
+
+        job = self.service.get(parts[1])
+        if job is None:
+            return self.send_json(404, {'error': "unknown job"})
+        if len(parts) == 2:
+            return self.send_json(200, job.to_json())
+        if parts[2] not in ('workbook', 'pivot'):
+            return self.send_json(404, {'error': "not found"})
+        if job.status != DONE:
+            return self.send_json(409, {'error': f"job is {job.status}", 'job': job.to_json()})
+
+        if parts[2] == 'workbook':
+            self.send_file(self.service.result_path(job.key, WORKBOOK_NAME), XLSX_TYPE,
+                           f"promo_analysis_{job.job_id[:8]}.xlsx")
+        else:
+            self.send_file(self.service.result_path(job.key, PIVOT_NAME), 'application/json')
+
+    def do_POST(self):
+        url = urlsplit(self.path)
+        if url.path.rstrip('/') != '/jobs':
+            return self.send_json(404, {'error': "not found"})
+
+        query = parse_qs(url.query)
+        if query.get('all_promos', ['0'])[0].lower() in ('1', 'true', 'yes'):
+            promos = list(PROMO_RULES)
+        else:
+            promos = query.get('promo') or DEFAULT_PROMOS
+        try:
+            check_promos(promos)
+        except ValueError as e:
+            return self.send_json(400, {'error': str(e)}, close=True)
+
+        length = self.headers.get('Content-Length')
+        if length is None:
+            return self.send_json(411, {'error': "Content-Length required"}, close=True)
+        try:
+            length = int(length)
+        except ValueError:
+            length = -1
+        if length < 0:
+            return self.send_json(400, {'error': "invalid Content-Length"}, close=True)
+        if length == 0:
+            return self.send_json(400, {'error': "empty upload; send the .xlsx export as the request body"})
+        if length > self.server.max_upload_bytes:
+            return self.send_json(413, {'error': f"upload larger than {self.server.max_upload_bytes:,} bytes"},
+                                  close=True)
+
+        upload, digest = self.receive_upload(length)
+        if upload is None:
+            return self.send_json(400, {'error': "upload ended early"}, close=True)
+        try:
+            job = self.service.submit(upload, digest, promos)
+        except Exception as e:
+            return self.send_json(500, {'error': f"could not start the job: {e}"})
+        if job is None:
+            return self.send_json(503, {'error': "all workers are busy; retry later"},
+                                  headers={'Retry-After': str(RETRY_AFTER_S)})
+        self.send_json(202, job.to_json(), headers={'Location': f"/jobs/{job.job_id}"})
+
+    def receive_upload(self, length):
+        # Stream the body to a file in the uploads directory, hashing as it goes
+        digest = hashlib.sha256()
+        fd, path = tempfile.mkstemp(dir=self.service.uploads_dir, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            remaining = length
+            while remaining:
+                block = self.rfile.read(min(UPLOAD_BLOCK, remaining))
+                if not block:
+                    break
+                digest.update(block)
+                f.write(block)
+                remaining -= len(block)
+        if remaining:
+            os.remove(path)
+            return None, None
+        return path, digest.hexdigest()
+
+    def send_json(self, status, body, headers=None, close=False):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        if close:
+            # The request body wasn't read; don't try to parse it as the next request
+            self.send_header('Connection', 'close')
+            self.close_connection = True
+        self.end_headers()
+        self.wfile.write(data)
+
+    def send_file(self, path, content_type, filename=None):
+        try:
+            f = open(path, 'rb')
+        except FileNotFoundError:
+            return self.send_json(410, {'error': "result no longer cached; submit the export again"})
+        with f:
+            self.send_response(200)
+            self.send_header('Content-Type', content_type)
+            self.send_header('Content-Length', str(os.fstat(f.fileno()).st_size))
+            if filename:
+                self.send_header('Content-Disposition', f'attachment; filename="{filename}"')
+            self.end_headers()
+            shutil.copyfileobj(f, self.wfile)
+
+
+def make_server(host, port, service, max_upload_bytes=MAX_UPLOAD_BYTES):
+    server = ThreadingHTTPServer((host, port), RequestHandler)
+    server.daemon_threads = True
+    server.service = service
+    server.max_upload_bytes = max_upload_bytes
+    return server
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve the promo analysis over HTTP.")
+    parser.add_argument("--host", default="127.0.0.1",
+                        help="interface to listen on; 0.0.0.0 to share the service (default: %(default)s)")
+    parser.add_argument("--port", type=int, default=int(os.environ.get("PORT", 8000)),
+                        help="port to listen on (default: $PORT or 8000)")
+    parser.add_argument("-j", "--workers", type=int, default=None,
+                        help="worker processes (default: one per CPU core)")
+    parser.add_argument("--queue-size", type=int, default=QUEUE_SIZE,
+                        help="jobs that may wait for a worker before uploads get 503 (default: %(default)s)")
+    parser.add_argument("--results-dir", default=RESULTS_DIR,
+                        help="where finished results are kept (default: %(default)s)")
+    parser.add_argument("--cache-dir", default=CACHE_DIR,
+                        help="where parsed exports are cached (default: %(default)s)")
+    parser.add_argument("--no-cache", action="store_true", help="always re-parse the exports")
+    parser.add_argument("--max-upload-mb", type=int, default=MAX_UPLOAD_BYTES // 1024 ** 2,
+                        help="largest accepted export (default: %(default)s)")
+    args = parser.parse_args(argv)
+
+    service = JobService(args.results_dir, args.workers, args.queue_size,
+                         cache_dir=None if args.no_cache else args.cache_dir)
+    server = make_server(args.host, args.port, service, args.max_upload_mb * 1024 ** 2)
+    print(f"Serving on http://{args.host}:{server.server_port} with {service.workers} worker(s)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
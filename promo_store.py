@@ -0,0 +1,287 @@
+"""Persistent analysis results keyed by order ID, so overlapping exports are only classified where they changed.
+
+Daily exports are rolling windows that mostly repeat the previous day's orders. The store
+keeps a content hash per order and, per line, the bitmask of every promo rule it matched
+(promo_engine.match_rules). A run only evaluates the rules for new or edited
+orders; the rest come from the store. Changing the promo selection re-resolves just the
+stored lines matched by a promo that was added or removed, and the Promo Type x Tier
+Group totals are kept up to date in place.
+"""
+import os
+import sqlite3
+from contextlib import contextmanager
+
+import numpy as np
+import pandas as pd
+
+from promo_cache import CACHE_DIR
+from promo_engine import (AnalysisCancelled, Features, RULE_BITS, finish_analysis, item_lines, match_rules,
+                          ranked_promos, resolve_matches)
+from promo_profile import NO_PROFILE
+from promo_rules import RULES_FINGERPRINT
+
+STORE_PATH = os.environ.get('PROMO_STORE_PATH') or os.path.join(CACHE_DIR, 'results.sqlite')
+
+LOCK_TIMEOUT_S = 600  # how long a batch worker waits for another one's update to finish
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL);
+CREATE TABLE IF NOT EXISTS orders (
+    order_id INTEGER PRIMARY KEY,
+    digest INTEGER NOT NULL,
+    matched BLOB NOT NULL  -- int64 rule bitmask of each of the order's lines, in line order
+);
+CREATE TABLE IF NOT EXISTS lines (
+    order_id INTEGER NOT NULL,
+    line_no INTEGER NOT NULL,
+    matched INTEGER NOT NULL,
+    promo_type TEXT NOT NULL,
+    tier_group TEXT NOT NULL,
+    line_total REAL NOT NULL,
+    line_quantity REAL NOT NULL,
+    PRIMARY KEY (order_id, line_no)
+);
+CREATE TABLE IF NOT EXISTS totals (
+    promo_type TEXT NOT NULL,
+    tier_group TEXT NOT NULL,
+    lines INTEGER NOT NULL,
+    line_total REAL NOT NULL,
+    line_quantity REAL NOT NULL,
+    PRIMARY KEY (promo_type, tier_group)
+);
+"""
+
+ADD_TOTALS = """
+INSERT INTO totals (promo_type, tier_group, lines, line_total, line_quantity) VALUES (?, ?, ?, ?, ?)
+ON CONFLICT (promo_type, tier_group) DO UPDATE SET
+    lines = lines + excluded.lines,
+    line_total = line_total + excluded.line_total,
+    line_quantity = line_quantity + excluded.line_quantity
+"""
+
+
+def line_keys(df):
+    # Each line's order ID as int64 (-1 where missing) and its position within the order
+    ids = pd.to_numeric(df['ID'], errors='coerce')
+    keyed = ids.notna().to_numpy()
+    keys = np.where(keyed, ids.fillna(-1).to_numpy(), -1).astype(np.int64)
+    line_no = pd.Series(keys).groupby(keys).cumcount().to_numpy()
+    return keys, keyed, line_no
+
+
+def order_digests(df, keys, keyed, line_no):
+    # One 64-bit content hash per order: editing, adding, removing or reordering any of its
+    # lines changes it. Returns (order_ids, digests), digests as int64 for SQLite.
+    row_hash = pd.util.hash_pandas_object(df, index=False).to_numpy()
+    row_hash = pd.util.hash_array(row_hash ^ pd.util.hash_array(line_no))
+    keys, row_hash = keys[keyed], row_hash[keyed]
+    if not len(keys):
+        return np.array([], dtype=np.int64), np.array([], dtype=np.int64)
+
+    order = np.argsort(keys, kind='stable')
+    keys, row_hash = keys[order], row_hash[order]
+    starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+    digests = np.add.reduceat(row_hash, starts)  # wraps modulo 2**64
+    return keys[starts], digests.view(np.int64)
+
+
+class ResultStore:
+    def __init__(self, path=STORE_PATH):
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        # Explicit transactions; the GUI opens the store on one worker thread and uses it on later ones
+        self.connection = sqlite3.connect(path, timeout=LOCK_TIMEOUT_S, isolation_level=None, check_same_thread=False)
+        self.connection.executescript(SCHEMA)
+        self.orders_seen = 0
+        self.orders_classified = 0
+        with self.transaction() as db:
+            # Any change to a rule definition or the priority order: classify every line again
+            if self._meta(db, 'rules') != RULES_FINGERPRINT:
+                self._clear(db)
+                self._set_meta(db, 'rules', RULES_FINGERPRINT)
+
+    @contextmanager
+    def transaction(self):
+        # IMMEDIATE takes the write lock up front, so concurrent batch workers queue up
+        # instead of both classifying an order and counting it twice
+        self.connection.execute('BEGIN IMMEDIATE')
+        try:
+            yield self.connection
+        except BaseException:
+            self.connection.execute('ROLLBACK')
+            raise
+        self.connection.execute('COMMIT')
+
+    def close(self):
+        self.connection.close()
+
+    def _meta(self, db, key):
+        row = db.execute('SELECT value FROM meta WHERE key = ?', (key,)).fetchone()
+        return row[0] if row else None
+
+    def _set_meta(self, db, key, value):
+        db.execute('INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)', (key, value))
+
+    def _clear(self, db):
+        for table in ['orders', 'lines', 'totals']:
+            db.execute(f'DELETE FROM {table}')
+        db.execute("DELETE FROM meta WHERE key = 'selection'")
+
+    def clear(self):
+        with self.transaction() as db:
+            self._clear(db)
+
+    def analyze(self, df, promos, progress=None, cancel=None, profile=NO_PROFILE):
+        # Same result as promo_engine.run_analysis(df, promos), classifying only the orders
+        # that aren't already stored unchanged, then recording them
+        ranked = ranked_promos(promos)
+        total_steps = 6
+        step = 0
+
+        def advance():
+            nonlocal step
+            if cancel is not None and cancel.is_set():
+                raise AnalysisCancelled()
+            step += 1
+            if progress is not None:
+                progress(step, total_steps)
+
+        features = Features(df)
+        with profile.stage("order digests", rows_in=len(df)):
+            keys, keyed, line_no = line_keys(df)
+            order_ids, digests = order_digests(df, keys, keyed, line_no)
+        advance()
+
+        with self.transaction() as db:
+            self._apply_selection(db, ranked, profile)
+
+            with profile.stage("load stored lines", rows_in=len(df)) as stage:
+                matched, unchanged = self._load_matches(db, keys, keyed, order_ids, digests)
+                stage['rows_out'] = np.count_nonzero(unchanged)
+            advance()
+
+            # Whole orders are classified together: multibuy and Promo Code rules look at the order
+            fresh = np.flatnonzero(~unchanged)
+            if len(fresh):
+                matched[fresh] = match_rules(Features(df.take(fresh)), profile=profile)
+            promo_type = resolve_matches(matched, ranked)
+            advance()
+
+            result = finish_analysis(df, features, promo_type, advance, profile)
+
+            with profile.stage("update store", rows_in=len(fresh)):
+                self._store_orders(db, df, features, keyed & ~unchanged, keys, line_no, matched, promo_type,
+                                   order_ids, digests)
+            self.orders_seen = len(order_ids)
+            self.orders_classified = len(np.unique(keys[keyed & ~unchanged]))
+        return result
+
+    def _load_matches(self, db, keys, keyed, order_ids, digests):
+        # Rule bitmasks of the lines of orders stored with the same digest, and which lines those are.
+        # Order IDs grow over time, so an export's orders are (nearly) one contiguous ID range.
+        matched = np.zeros(len(keys), dtype=np.int64)
+        unchanged = np.zeros(len(keys), dtype=bool)
+        if not len(order_ids):
+            return matched, unchanged
+        rows = db.execute('SELECT order_id, digest, matched FROM orders WHERE order_id BETWEEN ? AND ? '
+                          'ORDER BY order_id', (int(order_ids[0]), int(order_ids[-1]))).fetchall()
+        if rows:
+            stored_ids = np.fromiter((row[0] for row in rows), dtype=np.int64, count=len(rows))
+            stored_digests = np.fromiter((row[1] for row in rows), dtype=np.int64, count=len(rows))
+            # order_ids is sorted, so each stored order is found by binary search
+            at = np.minimum(np.searchsorted(order_ids, stored_ids), len(order_ids) - 1)
+            same = (order_ids[at] == stored_ids) & (digests[at] == stored_digests)
+            rows = [row for row, keep in zip(rows, same.tolist()) if keep]
+        if rows:
+            unchanged = np.isin(keys, np.array([row[0] for row in rows], dtype=np.int64)) & keyed
+            # Sorting the lines by order ID (stably, so line order is kept) lines them up with the blobs
+            reused = np.flatnonzero(unchanged)
+            reused = reused[np.argsort(keys[reused], kind='stable')]
+            stored = np.frombuffer(b''.join(row[2] for row in rows), dtype=np.int64)
+            if len(stored) != len(reused):  # only on a digest collision: classify everything again
+                return np.zeros(len(keys), dtype=np.int64), np.zeros(len(keys), dtype=bool)
+            matched[reused] = stored
+        return matched, unchanged
+
+    def _store_orders(self, db, df, features, fresh, keys, line_no, matched, promo_type, order_ids, digests):
+        # Replace the stored lines of every new or changed order, moving the totals with them
+        changed = np.unique(keys[fresh])
+        if not len(changed):
+            return
+        db.execute('CREATE TEMP TABLE IF NOT EXISTS changed (order_id INTEGER PRIMARY KEY)')
+        db.execute('DELETE FROM changed')
+        db.executemany('INSERT INTO changed VALUES (?)', ((order_id,) for order_id in changed.tolist()))
+
+        old = pd.read_sql_query(
+            'SELECT promo_type, tier_group, line_total, line_quantity FROM lines '
+            'WHERE order_id IN (SELECT order_id FROM changed)', db)
+        self._add_totals(db, old, sign=-1)
+        db.execute('DELETE FROM lines WHERE order_id IN (SELECT order_id FROM changed)')
+
+        rows = np.flatnonzero(fresh & item_lines(features))
+        new = pd.DataFrame({
+            'order_id': keys[rows],
+            'line_no': line_no[rows],
+            'matched': matched[rows],
+            'promo_type': promo_type[rows],
+            'tier_group': features.tier_group()[rows],
+            'line_total': pd.to_numeric(df['Line: Total'], errors='coerce').to_numpy()[rows],
+            'line_quantity': pd.to_numeric(df['Line: Quantity'], errors='coerce').to_numpy()[rows],
+        })
+        # Blank totals count as 0, as in the pivot's groupby sum
+        new[['line_total', 'line_quantity']] = new[['line_total', 'line_quantity']].fillna(0)
+        db.executemany('INSERT INTO lines VALUES (?, ?, ?, ?, ?, ?, ?)',
+                       new.astype(object).itertuples(index=False, name=None))
+        self._add_totals(db, new)
+
+        # One blob of line bitmasks per order, in the order _load_matches reads them back
+        lines_of = np.flatnonzero(fresh)
+        lines_of = lines_of[np.argsort(keys[lines_of], kind='stable')]
+        blobs = np.split(matched[lines_of], np.flatnonzero(np.diff(keys[lines_of])) + 1)
+        is_changed = np.isin(order_ids, changed)
+        db.executemany('INSERT OR REPLACE INTO orders VALUES (?, ?, ?)',
+                       zip(order_ids[is_changed].tolist(), digests[is_changed].tolist(),
+                           (blob.tobytes() for blob in blobs)))
+
+    def _apply_selection(self, db, ranked, profile):
+        # Lines matched by none of the added or removed promos keep their Promo Type
+        selection = ','.join(ranked)
+        previous = self._meta(db, 'selection')
+        if previous == selection:
+            return
+        if previous is not None:
+            with profile.stage("re-resolve stored lines") as stage:
+                toggled = set(previous.split(',')) ^ set(ranked)
+                bits = sum(1 << RULE_BITS[promo] for promo in toggled)
+                affected = pd.read_sql_query(
+                    'SELECT rowid, matched, promo_type, tier_group, line_total, line_quantity FROM lines '
+                    'WHERE matched & ? != 0', db, params=(bits,))
+                self._add_totals(db, affected, sign=-1)
+                affected['promo_type'] = resolve_matches(affected['matched'].to_numpy(), ranked)
+                self._add_totals(db, affected)
+                db.executemany('UPDATE lines SET promo_type = ? WHERE rowid = ?',
+                               zip(affected['promo_type'].tolist(), affected['rowid'].tolist()))
+                stage['rows_in'] = len(affected)
+        self._set_meta(db, 'selection', selection)
+
+    def _add_totals(self, db, lines, sign=1):
+        if not len(lines):
+            return
+        grouped = lines.groupby(['promo_type', 'tier_group'], observed=True).agg(
+            lines=('line_total', 'size'), line_total=('line_total', 'sum'), line_quantity=('line_quantity', 'sum'))
+        db.executemany(ADD_TOTALS, [(promo, tier, sign * count, sign * total, sign * quantity)
+                                    for (promo, tier), count, total, quantity
+                                    in zip(grouped.index, grouped['lines'].tolist(), grouped['line_total'].tolist(),
+                                           grouped['line_quantity'].tolist())])
+        db.execute('DELETE FROM totals WHERE lines = 0')
+
+    def totals(self):
+        # Stored Sales $ / quantity per Promo Type and Tier Group across every order seen
+        return pd.read_sql_query(
+            'SELECT promo_type AS "Promo Type", tier_group AS "Tier Group", '
+            'line_total AS "Line: Total", line_quantity AS "Line: Quantity" FROM totals '
+            'ORDER BY promo_type, tier_group', self.connection)
+
+    def promo_totals(self):
+        # In the shape of promo_engine.promo_totals, ready for pivot_from_totals
+        return self.totals().groupby('Promo Type')[['Line: Total', 'Line: Quantity']].sum()
@@ -0,0 +1,222 @@
+"""Seeded synthetic Shopify order exports with the columns the promo rules read.
+
+Real exports can't leave the business, so benchmarks and reproductions use these instead.
+Each order is drawn from one promo scenario (full price, markdown, a multibuy, UNIDAYS,
+...) and its lines are shaped so the matching rule fires, e.g. Chino Multibuy lines carry
+the discount:2_each_$110 tag and totals that are multiples of $110.
+
+Example:
+    python promo_synth.py synthetic_100k.xlsx --rows 100000 --seed 7
+"""
+import argparse
+import sys
+
+import numpy as np
+import pandas as pd
+
+# Relative weight of each order scenario
+DEFAULT_PROMO_MIX = {
+    "full_price": 30,
+    "markdown": 20,
+    "taf25": 4,
+    "selected_styles_25": 4,
+    "fifty_fifty": 4,
+    "tailoring_40": 2,
+    "sublime_suits": 2,
+    "tee_multibuy": 5,
+    "chino_multibuy": 4,
+    "linen_shirts_multibuy": 3,
+    "polo_multibuy": 3,
+    "suit_multibuy": 5,
+    "shirts_multibuy": 4,
+    "unidays": 6,
+    "gift_card": 4,
+}
+
+PRODUCT_TYPES = ["Chinos", "Outerwear", "Knitwear", "Shirts", "Suits", "Tees", "Polos", "Trousers", "Shoes"]
+TIER_TAGS = [None, "cx-tier-tier-1", "cx-tier-tier-2", "cx-tier-tier-3", "newsletter"]
+TIER_WEIGHTS = [0.3, 0.35, 0.2, 0.1, 0.05]
+SUIT_MULTIBUY_TOTALS = [175, 200, 275, 350, 400, 425, 575, 700]
+
+COLUMNS = ["ID", "Name", "Created At", "Customer: Tags", "Line: Type", "Line: Name", "Line: Title",
+           "Line: Product Type", "Line: Product Tags", "Line: Quantity", "Line: Price", "Line: Discount",
+           "Line: Discount per Item", "Line: Total", "Line: Variant Compare At Price"]
+
+
+def _catalog(rng, products, tag_cardinality):
+    # Product titles/types/prices, each with a few tags drawn from a pool of `tag_cardinality`
+    product_type = rng.choice(PRODUCT_TYPES, size=products)
+    title = np.array([f"{kind[:-1] if kind.endswith('s') else kind} {i:04d}" for i, kind in enumerate(product_type)],
+                     dtype=object)
+    price = rng.choice([79.95, 99.95, 129.95, 149.95, 199.95, 249.95, 349.0, 499.0], size=products)
+    pool = np.array([f"collection-{i:04d}" for i in range(max(tag_cardinality, 1))], dtype=object)
+    tags = np.array([", ".join(rng.choice(pool, size=rng.integers(1, 4), replace=False)) for _ in range(products)],
+                    dtype=object)
+    return title, product_type.astype(object), tags, price
+
+
+def generate_orders(rows, seed=0, mean_order_lines=2.5, tag_cardinality=200, products=500,
+                    promo_mix=None, shipping_share=0.5):
+    """Return a DataFrame of about `rows` export lines (item, discount and shipping lines)."""
+    rng = np.random.default_rng(seed)
+    promo_mix = promo_mix or DEFAULT_PROMO_MIX
+    scenarios = list(promo_mix)
+    weights = np.array([promo_mix[s] for s in scenarios], dtype=float)
+    weights /= weights.sum()
+
+    # Orders and their item lines
+    orders = max(int(rows / (mean_order_lines + shipping_share + 0.1)), 1)
+    items_per_order = 1 + rng.poisson(max(mean_order_lines - 1, 0), size=orders)
+    order_scenario = rng.choice(len(scenarios), size=orders, p=weights)
+    order_tier = rng.choice(len(TIER_TAGS), size=orders, p=TIER_WEIGHTS)
+    order_day = rng.integers(0, 365, size=orders)
+
+    order_of_line = np.repeat(np.arange(orders), items_per_order)
+    n = len(order_of_line)
+    scenario = order_scenario[order_of_line]
+
+    title, product_type, tags, price = _catalog(rng, products, tag_cardinality)
+    product = rng.integers(0, products, size=n)
+    line = {
+        "Line: Title": title[product].copy(),
+        "Line: Product Type": product_type[product].copy(),
+        "Line: Product Tags": tags[product].copy(),
+        "Line: Price": price[product].copy(),
+        "Line: Quantity": rng.choice([1, 1, 1, 2], size=n),
+        "Line: Variant Compare At Price": np.zeros(n),
+        "Line: Discount per Item": np.zeros(n),
+    }
+
+    def lines_of(name):
+        return np.flatnonzero(scenario == scenarios.index(name)) if name in scenarios else np.array([], dtype=int)
+
+    def add_tag(idx, tag):
+        line["Line: Product Tags"][idx] = [f"{t}, {tag}" for t in line["Line: Product Tags"][idx]]
+
+    def discount(idx, share):
+        line["Line: Discount per Item"][idx] = -np.round(line["Line: Price"][idx] * share, 2)
+
+    idx = lines_of("markdown")
+    line["Line: Variant Compare At Price"][idx] = np.round(line["Line: Price"][idx] * 1.4, 2)
+    idx = lines_of("taf25")
+    line["Line: Variant Compare At Price"][idx] = np.round(line["Line: Price"][idx] * 1.4, 2)
+    discount(idx, 0.25)
+    discount(lines_of("selected_styles_25"), 0.25)
+    idx = lines_of("fifty_fifty")
+    add_tag(idx, "5050Jul24")
+    discount(idx, 0.5)
+    idx = lines_of("tailoring_40")
+    add_tag(idx, "40_Off_Tailoring_May24")
+    discount(idx, 0.4)
+    # Sublime suits sell at $399 or $599 each: the ticket price is that plus the fixed discount
+    idx = lines_of("sublime_suits")
+    sale_price = rng.choice([399, 599], size=len(idx))
+    line["Line: Title"][idx] = "Sublime Suit"
+    line["Line: Product Type"][idx] = "Suits"
+    line["Line: Discount per Item"][idx] = rng.choice([-174.50, -199.50, -249.50], size=len(idx))
+    line["Line: Price"][idx] = sale_price - line["Line: Discount per Item"][idx]
+    for amount in [399, 599]:
+        add_tag(idx[sale_price == amount], f"automatic:${amount} Suits")
+    idx = lines_of("shirts_multibuy")
+    line["Line: Product Type"][idx] = "Shirts"
+    line["Line: Discount per Item"][idx] = -30
+    discount(lines_of("unidays"), 0.2)  # the code's discount allocated to the items
+    idx = lines_of("gift_card")
+    line["Line: Title"][idx] = "Gift Card"
+    line["Line: Product Type"][idx] = "Gift Card"
+    line["Line: Product Tags"][idx] = None
+    line["Line: Variant Compare At Price"][idx] = np.nan  # gift cards have no compare-at price
+
+    total = np.round((line["Line: Price"] + line["Line: Discount per Item"]) * line["Line: Quantity"], 2)
+
+    # Multibuys: two or more units at the bundle price, discounted down from the ticket price
+    for name, unit_total, tag, new_title in [("tee_multibuy", 40, None, "Mattia Tee"),
+                                             ("chino_multibuy", 110, "discount:2_each_$110", None),
+                                             ("linen_shirts_multibuy", 130, "discount:2_each_$130", None),
+                                             ("polo_multibuy", 109.99, "discount:2_each_$109", None)]:
+        idx = lines_of(name)
+        line["Line: Quantity"][idx] = rng.choice([1, 2, 3], size=len(idx))
+        if tag:
+            add_tag(idx, tag)
+        if new_title:
+            line["Line: Title"][idx] = new_title
+        line["Line: Price"][idx] = round(unit_total * 1.25, 2)
+        line["Line: Discount per Item"][idx] = round(unit_total - round(unit_total * 1.25, 2), 2)
+        total[idx] = np.round(unit_total * line["Line: Quantity"][idx], 2)
+    idx = lines_of("suit_multibuy")
+    line["Line: Title"][idx] = rng.choice(["Suit Jacket", "Suit Trouser"], size=len(idx))
+    line["Line: Discount per Item"][idx] = -50.0
+    total[idx] = rng.choice(SUIT_MULTIBUY_TOTALS, size=len(idx))
+
+    items = pd.DataFrame(line)
+    items["Line: Total"] = total
+    items["Line: Discount"] = np.round(items["Line: Discount per Item"] * items["Line: Quantity"], 2)
+    items["Line: Type"] = "Line Item"
+    items["Line: Name"] = items["Line: Title"]
+    items["_order"] = order_of_line
+
+    # Order-level lines: UNIDAYS codes and shipping
+    extra = []
+    unidays_orders = np.flatnonzero(order_scenario == scenarios.index("unidays")) if "unidays" in scenarios else []
+    if len(unidays_orders):
+        extra.append(pd.DataFrame({"_order": unidays_orders, "Line: Type": "Discount",
+                                   "Line: Name": rng.choice(["UNIDAYS", "UNIDAYS20"], size=len(unidays_orders)),
+                                   "Line: Quantity": 0, "Line: Total": -20.0, "Line: Discount": -20.0}))
+    shipped = np.flatnonzero(rng.random(orders) < shipping_share)
+    if len(shipped):
+        extra.append(pd.DataFrame({"_order": shipped, "Line: Type": "Shipping Line", "Line: Name": "Standard",
+                                   "Line: Title": "Standard Shipping", "Line: Quantity": 1, "Line: Price": 10.0,
+                                   "Line: Total": 10.0, "Line: Discount": 0.0}))
+
+    df = pd.concat([items] + extra, ignore_index=True)
+    df = df.sort_values("_order", kind="stable", ignore_index=True)  # an order's lines are contiguous
+    order = df.pop("_order").to_numpy()
+    df["ID"] = 5_000_000_000 + order
+    df["Name"] = ["#" + str(1001 + o) for o in order]
+    df["Created At"] = pd.Timestamp("2024-01-01") + pd.to_timedelta(order_day[order], unit="D")
+    df["Customer: Tags"] = np.array(TIER_TAGS, dtype=object)[order_tier[order]]
+    return df[COLUMNS]
+
+
+def write_export(df, file_path):
+    # Streams through the write-only writer; DataFrame.to_excel would hold every cell in memory
+    import openpyxl
+    from promo_export import RawSheetWriter, OVERFLOW_ERROR
+
+    workbook = openpyxl.Workbook(write_only=True)
+    RawSheetWriter(workbook, OVERFLOW_ERROR).write(df)
+    workbook.save(file_path)
+
+
+def parse_mix(text):
+    # "full_price=30,tee_multibuy=5" -> {"full_price": 30.0, "tee_multibuy": 5.0}
+    mix = {}
+    for part in text.split(","):
+        name, _, weight = part.partition("=")
+        if name.strip() not in DEFAULT_PROMO_MIX:
+            raise argparse.ArgumentTypeError(f"unknown scenario: {name.strip()}")
+        mix[name.strip()] = float(weight or 1)
+    return mix
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Write a synthetic Shopify order export.")
+    parser.add_argument("output", help="destination .xlsx")
+    parser.add_argument("--rows", type=int, default=10_000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--order-lines", type=float, default=2.5, help="mean item lines per order")
+    parser.add_argument("--tag-cardinality", type=int, default=200, help="distinct catalogue tags")
+    parser.add_argument("--mix", type=parse_mix, default=None,
+                        help="scenario weights, e.g. full_price=30,tee_multibuy=5 "
+                             f"(scenarios: {', '.join(DEFAULT_PROMO_MIX)})")
+    args = parser.parse_args(argv)
+
+    df = generate_orders(args.rows, seed=args.seed, mean_order_lines=args.order_lines,
+                         tag_cardinality=args.tag_cardinality, promo_mix=args.mix)
+    write_export(df, args.output)
+    print(f"Wrote {len(df):,} lines to {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())